@@ -5,13 +5,18 @@ import csv
 import html
 import hashlib
 import math
+import os
 from dataclasses import dataclass
+import functools
 import io
+from itertools import islice
 from pathlib import Path
 import tempfile
+import time
 import traceback
+import uuid
 from typing import Dict, List, Optional, Tuple
-import re
+import shutil
 
 import streamlit as st
 
@@ -28,16 +33,21 @@ from mandarin_anki.anki_preview import (
     ApkgPreview,
     ApkgPreviewError,
     PreviewCard,
+    compile_template,
     load_apkg_preview,
-    render_template as render_anki_template,
     wrap_card_html,
 )
-from mandarin_anki.builder import DEFAULT_COLUMNS
+from mandarin_anki.builder import (
+    DEFAULT_COLUMNS,
+    DefaultTTSFactory,
+    _clean,
+    _literal_to_br,
+)
+from mandarin_anki.audio_engine import _evict_lru
 
 st.set_page_config(page_title="Mandarin → Anki Builder", page_icon="🀄", layout="wide")
 
-st.markdown(
-    """
+APP_STYLE = """
     <style>
     :root { --bg:#0b0b0e; --panel:#15151c; --accent:#6ee7b7; --muted:#9aa3ad; --text:#eaeaf0; }
     html, body, [class^="css"]  { background-color: var(--bg) !important; color: var(--text) !important; }
@@ -49,16 +59,34 @@ st.markdown(
     hr { border: 0; border-top:1px solid #2a2a34; }
     .small { color: var(--muted); font-size: 0.9rem; }
     </style>
-    """,
-    unsafe_allow_html=True,
-)
+    """
+
+
+def _inject_css() -> None:
+    # Streamlit menghapus elemen yang tidak dirender ulang saat rerun, jadi CSS
+    # tetap harus dikirim setiap rerun; cukup satu elemen markdown kecil.
+    st.markdown(APP_STYLE, unsafe_allow_html=True)
+
+
+_inject_css()
 
 st.title("🀄 Mandarin → Anki Deck Builder v2.0")
 st.caption("Bangun deck Anki dari CSV atau buat audio Hanzi instan dalam satu aplikasi.")
 
-project_root = Path(".").resolve()
-default_speaker = project_root / "vocal_serena1.wav"
-default_ambient = project_root / "room.wav"
+@st.cache_resource
+def _project_paths() -> Tuple[Path, Path, Path, Path]:
+    # Diresolve sekali per proses, bukan setiap rerun.
+    root = Path(".").resolve()
+    # Versi lama menyimpan salinan pratinjau di .tts_cache/preview tanpa pernah
+    # menghapusnya; bersihkan sekali per proses.
+    shutil.rmtree(root / ".tts_cache" / "preview", ignore_errors=True)
+    return root, root / "vocal_serena1.wav", root / "room.wav", root / ".tts_cache"
+
+
+project_root, default_speaker, default_ambient, tts_cache_dir = _project_paths()
+UPLOAD_DIR = Path(tempfile.gettempdir()) / "mandarin_anki_uploads"
+# Dibatasi seperti .tts_cache: unggahan yang paling lama tidak dipakai dihapus.
+UPLOAD_DIR_MAX_BYTES = 200 * 1024 * 1024
 
 DECK_CARD_CSS = """
 .card { font-family: system-ui, 'Noto Sans CJK SC', 'PingFang SC', sans-serif; background:#0b0b0e; color:#eaeaf0; }
@@ -90,6 +118,27 @@ BUILDER_TEMPLATES = [
     },
 ]
 
+PREVIEW_CSS = DECK_CARD_CSS + """
+.preview-scroll { max-height: 520px; overflow-y: auto; padding-right: 1rem; }
+.preview-row { margin-bottom: 1.5rem; border:1px solid #2a2a34; border-radius:12px; padding:1rem; background:#15151c; }
+.preview-row__meta { font-weight:600; color:#9aa3ad; margin-bottom:0.75rem; }
+.preview-card { margin-bottom:1.25rem; }
+.preview-card:last-child { margin-bottom:0; }
+.preview-card__header { font-size:0.95rem; color:#6ee7b7; margin:0.4rem 0; }
+.preview-card__header--back { color:#f9a8d4; }
+.preview-card .card { border:1px solid #2a2a34; border-radius:10px; padding:0.75rem; background:#0b0b0e; }
+.preview-placeholder { color:#9aa3ad; font-style:italic; }
+.missing-media { color:#f87171; font-style:italic; }
+"""
+
+# Template builder hanya di-parse sekali; preview tiap baris cukup merender ulang.
+_COMPILED_TEMPLATES = [
+    (t["name"], compile_template(t["qfmt"]), compile_template(t["afmt"]))
+    for t in BUILDER_TEMPLATES
+]
+# Nama template tetap, jadi cukup di-escape sekali untuk judul kartu preview.
+_TEMPLATE_TITLES = {t["name"]: html.escape(t["name"]) for t in BUILDER_TEMPLATES}
+
 AUDIO_PLACEHOLDER_TEMPLATE = (
     "<span class='preview-placeholder'>Audio {name} akan dibuat saat ekspor deck.</span>"
 )
@@ -99,6 +148,19 @@ deck_speaker_file = None
 ambient_file = None  # dipakai juga oleh tab Hanzi→Audio
 
 
+@st.cache_resource(show_spinner="Memuat model TTS…")
+def _load_tts_model(model_name: str):
+    # Bobot XTTS (>1 GB) cukup dimuat sekali per proses, bukan setiap klik tombol.
+    # Objek ini dipakai bersama semua sesi; builder mengunci sintesis per model
+    # karena inferensi XTTS tidak thread-safe.
+    return DefaultTTSFactory().create(model_name)
+
+
+class _CachedTTSFactory:
+    def create(self, model_name: str):
+        return _load_tts_model(model_name)
+
+
 @dataclass(frozen=True)
 class BuilderPreviewCard:
     name: str
@@ -113,30 +175,15 @@ class BuilderPreviewRow:
     cards: List[BuilderPreviewCard]
 
 
-def _resolve_default_audio(label: str, default_path: Path) -> None:
-    if not default_path.exists():
-        st.sidebar.warning(f"Letakkan file default {label} di: {default_path}")
-
-
-def _clean_cell(value: Optional[str]) -> str:
-    if value is None:
-        return ""
-    return value.replace("\ufeff", "").replace("\u200b", "").strip()
-
-
-def _literal_preview(text: str, enable: bool) -> str:
-    if not enable:
-        return _clean_cell(text)
+@st.cache_data(ttl=60, show_spinner=False)
+def _default_exists(path: str) -> bool:
+    # Dicek sekali per menit, bukan di setiap rerun/ketikan.
+    return Path(path).exists()
 
-    s = _clean_cell(text)
-    if not s:
-        return ""
 
-    s = re.sub(r"\s*[，,；;]\s*", "<br>", s)
-    s = re.sub(r"(?:<br>\s*){2,}", "<br>", s).strip()
-    s = re.sub(r"^(<br>)+", "", s)
-    s = re.sub(r"(<br>)+$", "", s)
-    return s
+def _resolve_default_audio(label: str, default_path: Path) -> None:
+    if not _default_exists(str(default_path)):
+        st.sidebar.warning(f"Letakkan file default {label} di: {default_path}")
 
 
 def _resolve_columns_mapping(overrides: Dict[str, str]) -> Dict[str, str]:
@@ -147,12 +194,10 @@ def _resolve_columns_mapping(overrides: Dict[str, str]) -> Dict[str, str]:
 
 def _render_builder_cards(fields: Dict[str, str]) -> List[BuilderPreviewCard]:
     cards: List[BuilderPreviewCard] = []
-    for template in BUILDER_TEMPLATES:
-        front = render_anki_template(template["qfmt"], fields, media_map={})
-        back = render_anki_template(
-            template["afmt"], fields, media_map={}, front_side=front
-        )
-        cards.append(BuilderPreviewCard(name=template["name"], front=front, back=back))
+    for name, qfmt, afmt in _COMPILED_TEMPLATES:
+        front = qfmt.render(fields)
+        back = afmt.render(fields, front_side=front)
+        cards.append(BuilderPreviewCard(name=name, front=front, back=back))
     return cards
 
 
@@ -167,43 +212,48 @@ def _build_csv_preview_rows(
     audio_format: str,
     limit: int = 10,
 ) -> Tuple[List[BuilderPreviewRow], List[str]]:
-    text = csv_bytes.decode(encoding)
-    reader = csv.DictReader(io.StringIO(text), delimiter=delimiter)
-    fieldnames = [_clean_cell(name) for name in (reader.fieldnames or [])]
-    reader.fieldnames = fieldnames
+    # Didekode bertahap: begitu `limit` tercapai, sisa file tidak ikut didekode.
+    text_stream = io.TextIOWrapper(io.BytesIO(csv_bytes), encoding=encoding, newline="")
+    reader = csv.reader(text_stream, delimiter=delimiter)
+    # Posisi kolom cukup dicari sekali; tiap baris dibaca sebagai list biasa.
+    header = {_clean(name): pos for pos, name in enumerate(next(reader, []))}
+    positions = {key: header.get(name, -1) for key, name in columns.items()}
+
+    def cell(record: List[str], key: str) -> str:
+        pos = positions[key]
+        return _clean(record[pos]) if 0 <= pos < len(record) else ""
 
     base_name = Path(csv_name or "input.csv").stem.replace(" ", "_") or "deck"
+    audio_prefix = base_name.lower()
+    audio_ext = f".{audio_format}"
 
     rows: List[BuilderPreviewRow] = []
     errors: List[str] = []
-    for idx, raw in enumerate(reader, start=1):
-        if len(rows) >= limit:
-            break
-
-        clean_row = {_clean_cell(k): _clean_cell(v) for k, v in raw.items()}
-        hanzi = clean_row.get(columns["Hanzi"], "")
+    # Baris kosong dilewati dan tidak ikut dihitung, sama seperti DictReader.
+    for idx, record in enumerate(islice(filter(None, reader), limit), start=1):
+        hanzi = cell(record, "Hanzi")
         if not hanzi:
             errors.append(
                 f"Baris {idx}: kolom Hanzi kosong, kartu akan dilewati saat build."
             )
 
-        pinyin = clean_row.get(columns["Pinyin"], "")
-        indo = clean_row.get(columns["Indo"], "")
-        literal = clean_row.get(columns["Literal"], "")
-        grammar = clean_row.get(columns["Grammar"], "")
-        audio_name = clean_row.get(columns["Audio"], "")
-        enable_rm = clean_row.get(columns["Enable_RM"], "1") or "1"
-        enable_lt = clean_row.get(columns["Enable_LT"], "1") or "1"
-        enable_mp = clean_row.get(columns["Enable_MP"], "1") or "1"
-        tags = clean_row.get(columns["Tags"], "")
-        uid = clean_row.get(columns["UID"], "") or f"{base_name}-{idx:04d}"
+        pinyin = cell(record, "Pinyin")
+        indo = cell(record, "Indo")
+        literal = cell(record, "Literal")
+        grammar = cell(record, "Grammar")
+        audio_name = cell(record, "Audio")
+        enable_rm = cell(record, "Enable_RM") or "1"
+        enable_lt = cell(record, "Enable_LT") or "1"
+        enable_mp = cell(record, "Enable_MP") or "1"
+        tags = cell(record, "Tags")
+        uid = cell(record, "UID") or f"{base_name}-{idx:04d}"
 
-        literal_br = _literal_preview(literal, literal_linebreaks)
+        literal_br = _literal_to_br(literal, literal_linebreaks)
 
         if not audio_name:
-            audio_name = f"{base_name.lower()}_{idx:03d}.{audio_format}"
-        elif not audio_name.lower().endswith(f".{audio_format}"):
-            audio_name = f"{Path(audio_name).stem}.{audio_format}"
+            audio_name = f"{audio_prefix}_{idx:03d}{audio_ext}"
+        elif audio_name[-len(audio_ext):].lower() != audio_ext:
+            audio_name = f"{Path(audio_name).stem}{audio_ext}"
 
         placeholder = AUDIO_PLACEHOLDER_TEMPLATE.format(name=html.escape(audio_name))
 
@@ -236,63 +286,76 @@ def _reset_apkg_page() -> None:
 def _render_csv_preview_html(rows: List[BuilderPreviewRow]) -> str:
     row_blocks = []
     for row in rows:
-        cards_html = []
-        for card in row.cards:
-            cards_html.append(
-                """
-                <div class='preview-card'>
-                    <div class='preview-card__header'>{title} — Front</div>
-                    <div class='card'>{front}</div>
-                    <div class='preview-card__header preview-card__header--back'>{title} — Back</div>
-                    <div class='card'>{back}</div>
-                </div>
-                """.format(
-                    title=html.escape(card.name), front=card.front, back=card.back
-                )
-            )
-
+        cards_html = "".join(
+            f"<div class='preview-card'>"
+            f"<div class='preview-card__header'>{_TEMPLATE_TITLES[card.name]} — Front</div>"
+            f"<div class='card'>{card.front}</div>"
+            f"<div class='preview-card__header preview-card__header--back'>{_TEMPLATE_TITLES[card.name]} — Back</div>"
+            f"<div class='card'>{card.back}</div>"
+            f"</div>"
+            for card in row.cards
+        )
         row_blocks.append(
-            """
-            <div class='preview-row'>
-                <div class='preview-row__meta'>Baris {index} • UID: {uid}</div>
-                {cards}
-            </div>
-            """.format(index=row.index, uid=html.escape(row.uid), cards="".join(cards_html))
+            f"<div class='preview-row'>"
+            f"<div class='preview-row__meta'>Baris {row.index} • UID: {html.escape(row.uid)}</div>"
+            f"{cards_html}"
+            f"</div>"
         )
 
-    extra_css = """
-    .preview-scroll { max-height: 520px; overflow-y: auto; padding-right: 1rem; }
-    .preview-row { margin-bottom: 1.5rem; border:1px solid #2a2a34; border-radius:12px; padding:1rem; background:#15151c; }
-    .preview-row__meta { font-weight:600; color:#9aa3ad; margin-bottom:0.75rem; }
-    .preview-card { margin-bottom:1.25rem; }
-    .preview-card:last-child { margin-bottom:0; }
-    .preview-card__header { font-size:0.95rem; color:#6ee7b7; margin:0.4rem 0; }
-    .preview-card__header--back { color:#f9a8d4; }
-    .preview-card .card { border:1px solid #2a2a34; border-radius:10px; padding:0.75rem; background:#0b0b0e; }
-    .preview-placeholder { color:#9aa3ad; font-style:italic; }
-    .missing-media { color:#f87171; font-style:italic; }
-    """
-
     return (
         "<html><head><meta charset='utf-8'><style>"
-        + DECK_CARD_CSS
-        + extra_css
+        + PREVIEW_CSS
         + "</style></head><body><div class='preview-scroll'>"
         + "".join(row_blocks)
         + "</div></body></html>"
     )
 
-def _format_delimiter(label: str) -> str:
-    return "\t" if label == "\\t" else label
+@st.cache_data(show_spinner=False, max_entries=16)
+def _csv_preview(
+    file_id: str,
+    _csv_file,
+    *,
+    csv_name: str,
+    delimiter: str,
+    encoding: str,
+    columns: Dict[str, str],
+    literal_linebreaks: bool,
+    audio_format: str,
+) -> Tuple[Optional[str], List[str]]:
+    # Di-cache per file_id unggahan + pengaturan, agar rerun karena widget lain
+    # tidak menyalin, meng-hash, mem-parse, dan merender ulang isi CSV.
+    rows, errors = _build_csv_preview_rows(
+        _csv_file.getvalue(),
+        csv_name=csv_name,
+        delimiter=delimiter,
+        encoding=encoding,
+        columns=columns,
+        literal_linebreaks=literal_linebreaks,
+        audio_format=audio_format,
+    )
+    return (_render_csv_preview_html(rows) if rows else None), errors
 
 
 def _progress_callback_factory(status, progress_bar):
+    # Setiap update widget adalah round-trip ke browser; update per baris hanya
+    # saat persen berubah (maks. 20x per detik) atau paling lambat tiap 250 ms.
+    last_percent = -1
+    last_update = 0.0
+
     def _on_progress(event: ProgressEvent) -> None:
-        if event.message:
+        nonlocal last_percent, last_update
+        if event.message and event.stage != "row":
             status.write(event.message)
 
         if event.stage == "row" and event.total:
             percent = min(100, int(event.current / event.total * 100))
+            now = time.monotonic()
+            elapsed = now - last_update
+            if event.current < event.total and (
+                elapsed < 0.05 or (percent == last_percent and elapsed < 0.25)
+            ):
+                return
+            last_percent, last_update = percent, now
             progress_bar.progress(percent, text=f"Memproses kartu {event.current}/{event.total}")
         elif event.stage == "complete":
             progress_bar.progress(100, text="Deck selesai dibangun")
@@ -302,14 +365,51 @@ def _progress_callback_factory(status, progress_bar):
     return _on_progress
 
 
-def _prepare_audio_file(upload, tmp_dir: Path, filename: str, fallback: Path) -> Path:
-    if upload is not None:
-        path = tmp_dir / filename
-        path.write_bytes(upload.read())
-        return path
-    return fallback
-
-
+def _copy_upload(upload, path: Path) -> None:
+    # UploadedFile adalah BytesIO di memori (tidak ada file di disk untuk di-link
+    # atau di-sendfile); tulis buffernya langsung lewat memoryview tanpa salinan.
+    getbuffer = getattr(upload, "getbuffer", None)
+    with open(path, "wb") as handle:
+        if callable(getbuffer):
+            with getbuffer() as view:
+                handle.write(view)
+        else:
+            upload.seek(0)
+            shutil.copyfileobj(upload, handle, 1 << 20)
+
+
+ROW_ERROR_DISPLAY_LIMIT = 200
+
+
+def _render_row_errors(errors: List[str]) -> None:
+    # st.code tidak melewati parser Markdown; batasi jumlah baris yang dikirim.
+    st.code("\n".join(errors[:ROW_ERROR_DISPLAY_LIMIT]), language=None)
+    if len(errors) > ROW_ERROR_DISPLAY_LIMIT:
+        st.caption(f"… dan {len(errors) - ROW_ERROR_DISPLAY_LIMIT} baris lainnya.")
+
+
+def _prepare_audio_file(upload, fallback: Path) -> Path:
+    if upload is None:
+        return fallback
+    # Disimpan per hash isi: unggahan yang sama dipakai ulang lintas klik dan tab.
+    with upload.getbuffer() as view:
+        digest = hashlib.sha256(view).hexdigest()
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    path = UPLOAD_DIR / f"{digest}.wav"
+    try:
+        # Sentuh mtime agar unggahan yang dipakai ulang tidak tergusur lebih dulu.
+        os.utime(path)
+    except FileNotFoundError:
+        # Gusur sebelum menulis supaya unggahan baru tidak ikut terhapus walau
+        # ukurannya sendiri melebihi batas.
+        _evict_lru(UPLOAD_DIR, UPLOAD_DIR_MAX_BYTES)
+        partial = path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+        _copy_upload(upload, partial)
+        os.replace(partial, path)
+    return path
+
+
+@functools.lru_cache(maxsize=32)
 def _parse_ffmpeg_path(raw: str) -> Optional[Path]:
     text = (raw or "").strip()
     if text.startswith('"') and text.endswith('"'):
@@ -317,15 +417,21 @@ def _parse_ffmpeg_path(raw: str) -> Optional[Path]:
     return Path(text).expanduser() if text else None
 
 
-def _handle_generation(tmp_dir: Path, csv_bytes: bytes) -> Optional[DeckBuildResult]:
-    csv_path = tmp_dir / "input.csv"
-    csv_path.write_bytes(csv_bytes)
+@functools.lru_cache(maxsize=32)
+def _expand_dir(raw: str) -> Path:
+    return Path(raw).expanduser()
+
 
-    speaker_path = _prepare_audio_file(deck_speaker_file, tmp_dir, "speaker.wav", default_speaker)
+def _handle_generation(csv_upload, columns: Dict[str, str]) -> Optional[DeckBuildResult]:
+    # Builder membaca upload langsung dari memori; nama file tetap dipakai untuk
+    # judul deck dan nama audio (sama seperti di preview).
+    csv_path = Path(csv_upload.name or "input.csv")
+
+    speaker_path = _prepare_audio_file(deck_speaker_file, default_speaker)
     ambient_path = None
     if ambient_file:
-        ambient_path = _prepare_audio_file(ambient_file, tmp_dir, "ambient.wav", default_ambient)
-    elif default_ambient.exists():
+        ambient_path = _prepare_audio_file(ambient_file, default_ambient)
+    elif _default_exists(str(default_ambient)):
         ambient_path = default_ambient
 
     if not speaker_path.exists():
@@ -333,7 +439,7 @@ def _handle_generation(tmp_dir: Path, csv_bytes: bytes) -> Optional[DeckBuildRes
         return None
 
     ffmpeg_path = _parse_ffmpeg_path(ffmpeg_path_text)
-    out_dir = Path(output_dir_text).expanduser()
+    out_dir = _expand_dir(output_dir_text)
 
     with st.status("Menyiapkan…", expanded=True) as status:
         progress_bar = st.progress(0, text="Menyiapkan…")
@@ -341,6 +447,7 @@ def _handle_generation(tmp_dir: Path, csv_bytes: bytes) -> Optional[DeckBuildRes
             result = build_anki_deck(
                 DeckBuildConfig(
                     csv_path=csv_path,
+                    csv_stream=csv_upload,
                     output_dir=out_dir,
                     ffmpeg_path=ffmpeg_path,
                     tts_model_name=tts_model,
@@ -348,27 +455,19 @@ def _handle_generation(tmp_dir: Path, csv_bytes: bytes) -> Optional[DeckBuildRes
                     speaker_wav=speaker_path,
                     ambient_wav=ambient_path,
                     regenerate_audio_if_exists=regenerate,
-                    delimiter=_format_delimiter(delimiter_label),
+                    delimiter=delimiter_char,
                     encoding=encoding,
-                    columns={
-                        "Hanzi": col_hanzi,
-                        "Pinyin": col_pinyin,
-                        "Indo": col_indo,
-                        "Literal": col_literal,
-                        "Grammar": col_grammar,
-                        "Audio": col_audio,
-                        "Enable_RM": col_rm,
-                        "Enable_LT": col_lt,
-                        "Enable_MP": col_mp,
-                        "Tags": col_tags,
-                        "UID": col_uid,
-                    },
+                    columns=columns,
                     use_literal_linebreaks=literal_br,
                     volume_voice_db=voice_db,
                     volume_ambient_db=ambient_db,
                     bitrate=bitrate,
                     audio_format=audio_format,
+                    tts_fp16=tts_fp16,
+                    tts_compile=tts_compile,
+                    encode_workers=encode_jobs or None,
                 ),
+                tts_factory=_CachedTTSFactory(),
                 progress_callback=_progress_callback_factory(status, progress_bar),
             )
         except DeckBuildError as exc:
@@ -376,12 +475,12 @@ def _handle_generation(tmp_dir: Path, csv_bytes: bytes) -> Optional[DeckBuildRes
             status.error(str(exc))
             if exc.row_errors:
                 with st.expander("Detail galat per baris"):
-                    st.write("\n".join(exc.row_errors))
+                    _render_row_errors(exc.row_errors)
             return None
         except Exception as exc:  # pragma: no cover - defensive against unexpected issues
             progress_bar.progress(0, text="Gagal")
             status.error(f"Gagal: {exc}")
-            status.write("""<pre style='white-space:pre-wrap;'>""" + traceback.format_exc() + "</pre>", unsafe_allow_html=True)
+            status.exception(exc)
             st.toast("Terjadi error saat membangun deck.", icon="⚠️")
             return None
         else:
@@ -391,35 +490,46 @@ def _handle_generation(tmp_dir: Path, csv_bytes: bytes) -> Optional[DeckBuildRes
 with st.sidebar:
     st.header("⚙️ Settings")
 
-    ffmpeg_path_text = st.text_input("FFmpeg Path", "S:/ffmpeg/bin/ffmpeg.exe")
-    tts_model = st.text_input("TTS Model", "tts_models/multilingual/multi-dataset/xtts_v2")
-    tts_lang = st.text_input("Bahasa TTS", "zh-cn")
-
-    st.markdown("---")
-    st.subheader("🔊 Audio")
-    regenerate = st.checkbox("Regenerate audio jika file sudah ada", True)
-    voice_db = st.slider("Volume voice (dB, negatif lebih pelan)", -24, 6, -6)
-    ambient_db = st.slider("Volume ambient (dB, negatif lebih pelan)", -60, 0, -38)
-
-    st.markdown("---")
-    st.subheader("🧾 Parsing CSV")
-    delimiter_label = st.selectbox("Delimiter", [";", ",", "\\t"], index=0)
-    encoding = st.selectbox("Encoding", ["utf-8-sig", "utf-8", "cp936", "cp950"], index=0)
-    literal_br = st.checkbox("Literal → <br> (pisahkan dengan koma/semicolon)", True)
+    # Form: perubahan pengaturan baru memicu rerun saat tombol "Terapkan" ditekan,
+    # bukan di setiap ketikan atau geseran slider.
+    with st.form("settings", border=False):
+        ffmpeg_path_text = st.text_input("FFmpeg Path", "S:/ffmpeg/bin/ffmpeg.exe")
+        tts_model = st.text_input("TTS Model", "tts_models/multilingual/multi-dataset/xtts_v2")
+        tts_lang = st.text_input("Bahasa TTS", "zh-cn")
+        tts_fp16 = st.checkbox("Inferensi FP16 di GPU (matikan jika suara terdengar aneh)", True)
+        tts_compile = st.checkbox("Kompilasi decoder XTTS (torch.compile, eksperimental)", False)
+
+        st.markdown("---")
+        st.subheader("🔊 Audio")
+        regenerate = st.checkbox("Regenerate audio jika file sudah ada", True)
+        voice_db = st.slider("Volume voice (dB, negatif lebih pelan)", -24, 6, -6)
+        ambient_db = st.slider("Volume ambient (dB, negatif lebih pelan)", -60, 0, -38)
+        encode_jobs = st.slider(
+            "Proses mix/encode paralel (0 = otomatis, sesuai jumlah CPU)", 0, 16, 0
+        )
 
-    st.markdown("---")
-    st.subheader("🗂️ Mapping Kolom")
-    col_hanzi = st.text_input("Kolom Hanzi", "Hanzi")
-    col_pinyin = st.text_input("Kolom Pinyin", "Pinyin")
-    col_indo = st.text_input("Kolom Indo", "Indo")
-    col_literal = st.text_input("Kolom Literal", "Literal")
-    col_grammar = st.text_input("Kolom Grammar", "Grammar")
-    col_audio = st.text_input("Kolom Audio (opsional)", "Audio")
-    col_rm = st.text_input("Kolom Enable_RM", "Enable_RM")
-    col_lt = st.text_input("Kolom Enable_LT", "Enable_LT")
-    col_mp = st.text_input("Kolom Enable_MP", "Enable_MP")
-    col_tags = st.text_input("Kolom Tags", "Tags")
-    col_uid = st.text_input("Kolom UID", "UID")
+        st.markdown("---")
+        st.subheader("🧾 Parsing CSV")
+        delimiter_label = st.selectbox("Delimiter", [";", ",", "\\t"], index=0)
+        delimiter_char = "\t" if delimiter_label == "\\t" else delimiter_label
+        encoding = st.selectbox("Encoding", ["utf-8-sig", "utf-8", "cp936", "cp950"], index=0)
+        literal_br = st.checkbox("Literal → <br> (pisahkan dengan koma/semicolon)", True)
+
+        st.markdown("---")
+        st.subheader("🗂️ Mapping Kolom")
+        col_hanzi = st.text_input("Kolom Hanzi", "Hanzi")
+        col_pinyin = st.text_input("Kolom Pinyin", "Pinyin")
+        col_indo = st.text_input("Kolom Indo", "Indo")
+        col_literal = st.text_input("Kolom Literal", "Literal")
+        col_grammar = st.text_input("Kolom Grammar", "Grammar")
+        col_audio = st.text_input("Kolom Audio (opsional)", "Audio")
+        col_rm = st.text_input("Kolom Enable_RM", "Enable_RM")
+        col_lt = st.text_input("Kolom Enable_LT", "Enable_LT")
+        col_mp = st.text_input("Kolom Enable_MP", "Enable_MP")
+        col_tags = st.text_input("Kolom Tags", "Tags")
+        col_uid = st.text_input("Kolom UID", "UID")
+
+        st.form_submit_button("✅ Terapkan pengaturan", use_container_width=True)
 
     _resolve_default_audio("speaker (vocal_serena1.wav)", default_speaker)
     _resolve_default_audio("ambient (room.wav)", default_ambient)
@@ -435,8 +545,6 @@ deck_tab, audio_tab, preview_tab = st.tabs([
 # TAB: Deck Builder
 # ------------------
 with deck_tab:
-    csv_preview_bytes: Optional[bytes] = None
-    csv_preview_rows: List[BuilderPreviewRow] = []
     csv_preview_errors: List[str] = []
     csv_preview_error_message: Optional[str] = None
     csv_preview_html: Optional[str] = None
@@ -474,7 +582,6 @@ with deck_tab:
 
     st.markdown("---")
 
-    delimiter_char = _format_delimiter(delimiter_label)
     column_mapping = _resolve_columns_mapping(
         {
             "Hanzi": col_hanzi,
@@ -492,10 +599,10 @@ with deck_tab:
     )
 
     if csv_file is not None:
-        csv_preview_bytes = csv_file.getvalue()
         try:
-            csv_preview_rows, csv_preview_errors = _build_csv_preview_rows(
-                csv_preview_bytes,
+            csv_preview_html, csv_preview_errors = _csv_preview(
+                csv_file.file_id,
+                csv_file,
                 csv_name=csv_file.name or "input.csv",
                 delimiter=delimiter_char,
                 encoding=encoding,
@@ -509,12 +616,6 @@ with deck_tab:
             )
         except csv.Error as exc:
             csv_preview_error_message = f"Gagal membaca CSV: {exc}"
-        else:
-            if csv_preview_rows:
-                csv_preview_html = _render_csv_preview_html(csv_preview_rows)
-            st.session_state["csv_preview_bytes"] = csv_preview_bytes
-    else:
-        st.session_state.pop("csv_preview_bytes", None)
 
     if csv_preview_error_message:
         st.error(csv_preview_error_message)
@@ -540,27 +641,22 @@ with deck_tab:
         elif csv_preview_error_message:
             st.error("Perbaiki error CSV terlebih dahulu sebelum melanjutkan build deck.")
         else:
-            payload = csv_preview_bytes or st.session_state.get("csv_preview_bytes")
-            if not payload:
-                payload = csv_file.getvalue()
-
-            with tempfile.TemporaryDirectory() as tmpdir:
-                result = _handle_generation(Path(tmpdir), payload)
+            result = _handle_generation(csv_file, column_mapping)
 
             if result:
                 st.success(f"Selesai! {result.rows_processed} kartu berhasil dibuat.")
                 if result.row_errors:
                     st.warning(f"Ada {len(result.row_errors)} baris dilewati.")
                     with st.expander("Lihat detail baris yang dilewati"):
-                        st.write("\n".join(result.row_errors))
-
-                data = result.apkg_path.read_bytes()
-                st.download_button(
-                    "⬇️ Download .apkg",
-                    data,
-                    file_name=result.apkg_path.name,
-                    mime="application/vnd.anki",
-                )
+                        _render_row_errors(result.row_errors)
+
+                with open(result.apkg_path, "rb") as apkg_handle:
+                    st.download_button(
+                        "⬇️ Download .apkg",
+                        apkg_handle,
+                        file_name=result.apkg_path.name,
+                        mime="application/vnd.anki",
+                    )
 
 # ------------------
 # TAB: Hanzi → Audio
@@ -591,64 +687,68 @@ with audio_tab:
         if not hanzi_text.strip():
             st.warning("Masukkan teks Hanzi terlebih dahulu.")
         else:
-            with tempfile.TemporaryDirectory() as tmpdir:
-                tmp_dir = Path(tmpdir)
-                speaker_path = _prepare_audio_file(
-                    audio_speaker_file, tmp_dir, "speaker.wav", default_speaker
-                )
-                ambient_path = None
-                if ambient_file:
-                    ambient_path = _prepare_audio_file(ambient_file, tmp_dir, "ambient.wav", default_ambient)
-                elif default_ambient.exists():
-                    ambient_path = default_ambient
-
-                if not speaker_path.exists():
-                    st.error("Speaker WAV tidak ditemukan (upload atau letakkan 'vocal_serena1.wav' di root proyek).")
+            speaker_path = _prepare_audio_file(audio_speaker_file, default_speaker)
+            ambient_path = None
+            if ambient_file:
+                ambient_path = _prepare_audio_file(ambient_file, default_ambient)
+            elif _default_exists(str(default_ambient)):
+                ambient_path = default_ambient
+
+            if not speaker_path.exists():
+                st.error("Speaker WAV tidak ditemukan (upload atau letakkan 'vocal_serena1.wav' di root proyek).")
+            else:
+                # Klip disimpan langsung di cache TTS (dibatasi LRU); sesi cukup
+                # menyimpan path-nya, bukan byte audio atau salinan pratinjau.
+                try:
+                    generated_path = generate_audio_from_text(
+                        AudioGenerationConfig(
+                            text=hanzi_text,
+                            output_path=None,
+                            speaker_wav=speaker_path,
+                            ambient_wav=ambient_path,
+                            ffmpeg_path=_parse_ffmpeg_path(ffmpeg_path_text),
+                            tts_model_name=tts_model,
+                            tts_lang=tts_lang,
+                            volume_voice_db=voice_db,
+                            volume_ambient_db=ambient_db,
+                            bitrate=bitrate,
+                            audio_format=audio_format,
+                            tts_fp16=tts_fp16,
+                            cache_dir=tts_cache_dir,
+                        ),
+                        tts_factory=_CachedTTSFactory(),
+                    )
+                except DeckBuildError as exc:
+                    st.error(str(exc))
+                except Exception as exc:  # pragma: no cover
+                    st.error(f"Gagal menghasilkan audio: {exc}")
+                    st.exception(exc)
                 else:
-                    output_file = tmp_dir / f"hanzi_audio.{audio_format}"
-                    try:
-                        generated_path = generate_audio_from_text(
-                            AudioGenerationConfig(
-                                text=hanzi_text,
-                                output_path=output_file,
-                                speaker_wav=speaker_path,
-                                ambient_wav=ambient_path,
-                                ffmpeg_path=_parse_ffmpeg_path(ffmpeg_path_text),
-                                tts_model_name=tts_model,
-                                tts_lang=tts_lang,
-                                volume_voice_db=voice_db,
-                                volume_ambient_db=ambient_db,
-                                bitrate=bitrate,
-                                audio_format=audio_format,
-                            )
-                        )
-                    except DeckBuildError as exc:
-                        st.error(str(exc))
-                    except Exception as exc:  # pragma: no cover
-                        st.error(f"Gagal menghasilkan audio: {exc}")
-                        st.write(
-                            """<pre style='white-space:pre-wrap;'>""" + traceback.format_exc() + "</pre>",
-                            unsafe_allow_html=True,
-                        )
-                    else:
-                        data = generated_path.read_bytes()
-                        mime = "audio/mpeg" if audio_format == "mp3" else "audio/wav"
-                        filename = f"hanzi_audio.{audio_format}"
-                        preview_state.update({
-                            "data": data,
-                            "mime": mime,
-                            "filename": filename,
-                        })
-                        st.success("Audio berhasil dibuat.")
-
-    if preview_state.get("data"):
-        st.audio(preview_state["data"], format=preview_state.get("mime", "audio/mpeg"))
-        st.download_button(
-            "⬇️ Download Audio",
-            preview_state["data"],
-            file_name=preview_state.get("filename", "hanzi_audio.mp3"),
-            mime=preview_state.get("mime", "audio/mpeg"),
-        )
+                    mime = "audio/mpeg" if audio_format == "mp3" else "audio/wav"
+                    filename = f"hanzi_audio.{audio_format}"
+                    preview_state.update({
+                        "path": str(generated_path),
+                        "mime": mime,
+                        "filename": filename,
+                    })
+                    st.success("Audio berhasil dibuat.")
+
+    if preview_state.get("path"):
+        try:
+            preview_handle = open(preview_state["path"], "rb")
+        except OSError:
+            # Klip sudah tergusur dari cache; pratinjau lama tidak bisa diputar lagi.
+            preview_state.clear()
+        else:
+            with preview_handle:
+                st.audio(preview_handle, format=preview_state.get("mime", "audio/mpeg"))
+                preview_handle.seek(0)
+                st.download_button(
+                    "⬇️ Download Audio",
+                    preview_handle,
+                    file_name=preview_state.get("filename", "hanzi_audio.mp3"),
+                    mime=preview_state.get("mime", "audio/mpeg"),
+                )
 
 # ------------------
 # TAB: Anki Deck Previewer
@@ -687,60 +787,50 @@ with preview_tab:
     session.setdefault("apkg_filter", "")
     session.setdefault("apkg_error", None)
     session.setdefault("apkg_error_traceback", None)
-    session.setdefault("apkg_digest", None)
+    session.setdefault("apkg_file_id", None)
     session.setdefault("apkg_filename", None)
 
     apkg_file = st.file_uploader(
         "Deck Anki (.apkg)", type=["apkg"], key="deck_previewer_apkg_uploader"
     )
 
-    if apkg_file is not None:
-        apkg_bytes = apkg_file.getvalue()
-        digest = hashlib.sha1(apkg_bytes).hexdigest()
-        if session.get("apkg_digest") != digest:
-            with st.spinner("Memuat deck…"):
-                try:
-                    preview_data: ApkgPreview = load_apkg_preview(apkg_bytes)
-                except ApkgPreviewError as exc:
-                    session["apkg_error"] = str(exc)
-                    session["apkg_error_traceback"] = None
-                    session["apkg_cards"] = []
-                    session["apkg_selected_card_id"] = None
-                except Exception as exc:  # pragma: no cover - defensive logging
-                    session["apkg_error"] = f"Gagal memuat deck: {exc}"
-                    session["apkg_error_traceback"] = traceback.format_exc()
-                    session["apkg_cards"] = []
-                    session["apkg_selected_card_id"] = None
-                else:
-                    session["apkg_error"] = None
-                    session["apkg_error_traceback"] = None
-                    session["apkg_digest"] = digest
-                    session["apkg_filename"] = apkg_file.name
-                    session["apkg_cards"] = preview_data.cards
-                    session["apkg_selected_card_id"] = (
-                        preview_data.cards[0].card_id if preview_data.cards else None
-                    )
-                    session["apkg_show_answer"] = False
-                    session["apkg_page"] = 1
-                    session["apkg_filter"] = ""
-                    session.pop("apkg_card_radio", None)
+    # file_id berubah setiap kali file diunggah ulang, jadi deck tidak perlu
+    # di-hash ulang (atau di-parse ulang saat gagal) di setiap rerun.
+    if apkg_file is not None and session.get("apkg_file_id") != apkg_file.file_id:
+        session["apkg_file_id"] = apkg_file.file_id
+        with st.spinner("Memuat deck…"):
+            try:
+                preview_data: ApkgPreview = load_apkg_preview(apkg_file.getvalue())
+            except ApkgPreviewError as exc:
+                session["apkg_error"] = str(exc)
+                session["apkg_error_traceback"] = None
+                session["apkg_cards"] = []
+                session["apkg_selected_card_id"] = None
+            except Exception as exc:  # pragma: no cover - defensive logging
+                session["apkg_error"] = f"Gagal memuat deck: {exc}"
+                session["apkg_error_traceback"] = traceback.format_exc()
+                session["apkg_cards"] = []
+                session["apkg_selected_card_id"] = None
+            else:
+                session["apkg_error"] = None
+                session["apkg_error_traceback"] = None
+                session["apkg_filename"] = apkg_file.name
+                session["apkg_cards"] = preview_data.cards
+                session["apkg_selected_card_id"] = (
+                    preview_data.cards[0].card_id if preview_data.cards else None
+                )
+                session["apkg_show_answer"] = False
+                session["apkg_page"] = 1
+                session["apkg_filter"] = ""
+                session.pop("apkg_card_radio", None)
     if session.get("apkg_error"):
         st.error(session["apkg_error"])
         if session.get("apkg_error_traceback"):
-            st.write(
-                """<pre style='white-space:pre-wrap;'>"""
-                + session["apkg_error_traceback"]
-                + "</pre>",
-                unsafe_allow_html=True,
-            )
+            st.code(session["apkg_error_traceback"], language=None)
 
     cards: List[PreviewCard] = session.get("apkg_cards") or []
     if cards:
         selected_id = session.get("apkg_selected_card_id")
-        all_ids = {card.card_id for card in cards}
-        if selected_id not in all_ids:
-            selected_id = cards[0].card_id
-            session["apkg_selected_card_id"] = selected_id
 
         filtered_cards: List[PreviewCard] = cards
         paged_cards: List[PreviewCard] = cards
@@ -807,25 +897,13 @@ with preview_tab:
             paged_cards = filtered_cards[start_idx:end_idx]
 
             if paged_cards:
-                filtered_ids = {card.card_id for card in filtered_cards}
-                selection_changed = False
-                if selected_id not in filtered_ids:
-                    selected_id = paged_cards[0].card_id
-                    session["apkg_selected_card_id"] = selected_id
-                    selection_changed = True
-
-                page_ids = [card.card_id for card in paged_cards]
-                if selected_id not in page_ids:
-                    selected_id = paged_cards[0].card_id
-                    session["apkg_selected_card_id"] = selected_id
-                    selection_changed = True
-
                 labels: List[str] = []
                 label_to_id: Dict[str, int] = {}
+                id_to_label: Dict[int, str] = {}
                 for card in paged_cards:
                     summary = card.front_summary or "(kosong)"
                     if len(summary) > 80:
-                        summary = summary[:77] + "…"
+                        summary = f"{summary[:77]}…"
                     base_label = f"{card.deck_name} • {summary}"
                     label = (
                         base_label
@@ -834,11 +912,14 @@ with preview_tab:
                     )
                     labels.append(label)
                     label_to_id[label] = card.card_id
+                    id_to_label[card.card_id] = label
 
-                default_label = next(
-                    (label for label, cid in label_to_id.items() if cid == selected_id),
-                    labels[0],
-                )
+                # Kartu terpilih harus ada di halaman ini (dan lolos filter).
+                selection_changed = selected_id not in id_to_label
+                if selection_changed:
+                    selected_id = paged_cards[0].card_id
+                    session["apkg_selected_card_id"] = selected_id
+                default_label = id_to_label[selected_id]
                 if (
                     session.get("apkg_card_radio") not in label_to_id
                     or selection_changed
@@ -864,31 +945,21 @@ with preview_tab:
                 session["apkg_selected_card_id"] = None
                 session.pop("apkg_card_radio", None)
 
+        # Kartu terpilih selalu berada di halaman aktif, jadi cukup cari di sana.
         selected_card = None
+        card_position: Optional[int] = None
         if session.get("apkg_selected_card_id") is not None:
-            selected_card = next(
-                (
-                    card
-                    for card in cards
-                    if card.card_id == session["apkg_selected_card_id"]
-                ),
-                None,
-            )
+            for offset, card in enumerate(paged_cards):
+                if card.card_id == session["apkg_selected_card_id"]:
+                    selected_card = card
+                    card_position = start_idx + offset + 1
+                    break
 
         with preview_col:
             if selected_card is None:
                 st.info("Pilih kartu dari daftar kiri untuk melihat preview.")
             else:
                 show_answer = session.get("apkg_show_answer", False)
-                total_filtered = len(filtered_cards)
-                card_position = (
-                    next(
-                        (idx for idx, card in enumerate(filtered_cards, start=1) if card.card_id == selected_card.card_id),
-                        None,
-                    )
-                    if filtered_cards
-                    else None
-                )
 
                 st.markdown("<div class='apkg-preview-header-block'>", unsafe_allow_html=True)
                 header_left, header_right = st.columns([1, 1])
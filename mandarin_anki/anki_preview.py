@@ -4,15 +4,22 @@ from __future__ import annotations
 from dataclasses import dataclass
 import base64
 import html
+import io
 import json
 import mimetypes
 import re
+import shutil
 import sqlite3
 import tempfile
 from pathlib import Path
-from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+from typing import IO, Any, Dict, Iterable, List, Mapping, Optional, Tuple, Union
 import zipfile
 
+try:  # Optional: only speeds up parsing the collection's model/deck JSON.
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
 
 class ApkgPreviewError(RuntimeError):
     """Raised when an uploaded ``.apkg`` file cannot be parsed."""
@@ -45,15 +52,16 @@ FIELD_RE = re.compile(r"{{([^{}]+)}}")
 SECTION_RE = re.compile(r"{{([#^])([^{}]+)}}")
 CLOZE_RE = re.compile(r"{{c\d+::(.*?)(?:::(.*?))?}}", re.DOTALL)
 SOUND_RE = re.compile(r"\[sound:([^\]]+)\]")
+_SCRIPT_STYLE_RE = re.compile(r"<(script|style)[^>]*>.*?</\1>", re.DOTALL | re.IGNORECASE)
+_TAG_RE = re.compile(r"<[^>]+>")
+_WHITESPACE_RE = re.compile(r"\s+")
 
 
 def load_apkg_preview(apkg_bytes: bytes) -> ApkgPreview:
     """Parse a ``.apkg`` archive and return rendered card previews."""
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        tmp_path = Path(tmpdir) / "uploaded.apkg"
-        tmp_path.write_bytes(apkg_bytes)
-        return _load_from_path(tmp_path)
+    # ZipFile reads straight from memory; only collection.anki2 touches disk.
+    return _load_archive(io.BytesIO(apkg_bytes))
 
 
 def wrap_card_html(body: str, css: str) -> str:
@@ -74,20 +82,74 @@ def render_template(
     *,
     media_map: Optional[Mapping[str, bytes]] = None,
     front_side: Optional[str] = None,
+    encoded: Optional[Dict[str, str]] = None,
 ) -> str:
     """Render an Anki template with the provided field values."""
 
-    rendered = _render_sections(template, fields)
-    if "{{FrontSide}}" in rendered:
-        rendered = rendered.replace("{{FrontSide}}", front_side or "")
-    rendered = FIELD_RE.sub(lambda m: _replace_field(m, fields), rendered)
-    rendered = _replace_sound_refs(rendered, media_map or {})
-    return rendered
+    return compile_template(template).render(
+        fields, media_map=media_map, front_side=front_side, encoded=encoded
+    )
+
+
+@dataclass(frozen=True)
+class _Field:
+    expr: str
+
+
+@dataclass(frozen=True)
+class _Section:
+    field: str
+    inverted: bool
+    children: Tuple[Any, ...]
 
 
-def _load_from_path(path: Path) -> ApkgPreview:
+@dataclass(frozen=True)
+class CompiledTemplate:
+    """Anki template parsed once into literal text, fields and sections.
+
+    ``nodes`` is ``None`` when the sections are not properly nested; such
+    templates are rendered by rescanning the source as Anki-like best effort.
+    """
+
+    source: str
+    nodes: Optional[Tuple[Any, ...]]
+
+    def render(
+        self,
+        fields: Mapping[str, str],
+        *,
+        media_map: Optional[Mapping[str, bytes]] = None,
+        front_side: Optional[str] = None,
+        encoded: Optional[Dict[str, str]] = None,
+    ) -> str:
+        """``encoded`` memoises the ``<audio>`` tag per media filename; pass the
+        same dict when rendering many cards against one ``media_map``.
+        """
+        if self.nodes is None:
+            rendered = _render_sections(self.source, fields)
+            if "{{FrontSide}}" in rendered:
+                rendered = rendered.replace("{{FrontSide}}", front_side or "")
+            rendered = FIELD_RE.sub(lambda m: _replace_field(m, fields), rendered)
+        elif len(self.nodes) == 1 and isinstance(self.nodes[0], str):
+            rendered = self.nodes[0]
+        else:
+            pieces: List[str] = []
+            _render_nodes(self.nodes, fields, front_side or "", pieces)
+            rendered = "".join(pieces)
+        return _replace_sound_refs(
+            rendered, media_map or {}, {} if encoded is None else encoded
+        )
+
+
+def compile_template(template: str) -> CompiledTemplate:
+    """Parse ``template`` once so it can be rendered for many notes."""
+
+    return CompiledTemplate(source=template, nodes=_parse_nodes(template))
+
+
+def _load_archive(source: Union[Path, IO[bytes]]) -> ApkgPreview:
     try:
-        with zipfile.ZipFile(path) as archive:
+        with zipfile.ZipFile(source) as archive:
             try:
                 with archive.open("media") as handle:
                     media_map = json.load(handle)
@@ -96,91 +158,136 @@ def _load_from_path(path: Path) -> ApkgPreview:
 
             media_bytes: Dict[str, bytes] = {}
             for key, name in media_map.items():
-                if not name:
+                # A name listed twice keeps its first entry instead of being
+                # decompressed again and silently replaced.
+                if not name or name in media_bytes:
                     continue
                 try:
                     media_bytes[name] = archive.read(key)
                 except KeyError:
                     continue
 
+            # Only the collection database has to exist on disk for sqlite3; the
+            # media entries were already read into memory above.
             with tempfile.TemporaryDirectory() as tmp_extract:
-                archive.extractall(tmp_extract)
                 collection_path = Path(tmp_extract) / "collection.anki2"
+                try:
+                    with archive.open("collection.anki2") as src:
+                        with open(collection_path, "wb") as dst:
+                            shutil.copyfileobj(src, dst, 1 << 20)
+                except KeyError:
+                    collection_path.unlink(missing_ok=True)
                 return _load_collection(collection_path, media_bytes)
     except zipfile.BadZipFile as exc:  # pragma: no cover - defensive
         raise ApkgPreviewError("File .apkg tidak valid atau rusak.") from exc
 
 
+@dataclass(frozen=True)
+class _CompiledModel:
+    field_names: List[str]
+    css: str
+    templates: List[Tuple[str, CompiledTemplate, CompiledTemplate]]
+
+
+def _loads_json(text: str) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass  # e.g. integers beyond 64 bits; the stdlib parser accepts those
+    return json.loads(text)
+
+
+def _compile_model(model: Optional[Mapping[str, Any]]) -> Optional[_CompiledModel]:
+    if not model:
+        return None
+    templates: Iterable[Mapping[str, str]] = model.get("tmpls", [])
+    return _CompiledModel(
+        field_names=[fld.get("name", "") for fld in model.get("flds", [])],
+        css=model.get("css", ""),
+        templates=[
+            (
+                str(template.get("name", f"Card {ord_index}")),
+                compile_template(template.get("qfmt", "")),
+                compile_template(template.get("afmt", "")),
+            )
+            for ord_index, template in enumerate(templates)
+        ],
+    )
+
+
 def _load_collection(collection_path: Path, media_bytes: Mapping[str, bytes]) -> ApkgPreview:
     if not collection_path.exists():
         raise ApkgPreviewError("File .apkg tidak memiliki collection.anki2.")
 
     conn = sqlite3.connect(str(collection_path))
-    conn.row_factory = sqlite3.Row
     try:
+        # Read-only scratch copy: keep the ORDER BY sort out of temp files.
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute("PRAGMA temp_store = MEMORY")
         col_row = conn.execute("SELECT models, decks FROM col").fetchone()
         if col_row is None:
             raise ApkgPreviewError("Database Anki tidak memiliki metadata deck.")
 
-        models = json.loads(col_row["models"] or "{}")
-        decks = json.loads(col_row["decks"] or "{}")
+        models = _loads_json(col_row[0] or "{}")
+        decks = _loads_json(col_row[1] or "{}")
         deck_names = {int(k): v.get("name", f"Deck {k}") for k, v in decks.items() if isinstance(v, dict)}
 
-        note_rows = conn.execute("SELECT id, mid, flds FROM notes").fetchall()
-        notes = {
-            row["id"]: (row["mid"], row["flds"].split("\x1f"))
-            for row in note_rows
+        # Fields stay joined until a card of the note is rendered.
+        notes: Dict[int, Tuple[int, str]] = {
+            nid: (mid, flds) for nid, mid, flds in conn.execute("SELECT id, mid, flds FROM notes")
         }
 
-        card_rows = conn.execute(
-            "SELECT id, nid, did, ord FROM cards ORDER BY did, id"
-        ).fetchall()
+        card_rows = conn.execute("SELECT id, nid, did, ord FROM cards ORDER BY did, id")
+
+        # Field names and templates are parsed once per note type, not per card,
+        # and each note's field map is shared by all of its cards.
+        compiled_models: Dict[int, Optional[_CompiledModel]] = {}
+        field_maps: Dict[int, Dict[str, str]] = {}
+        # A clip usually appears on several cards and on both sides of each
+        # one; its data URI is built once per archive, keyed by filename.
+        encoded: Dict[str, str] = {}
 
         cards: List[PreviewCard] = []
-        for row in card_rows:
-            note = notes.get(row["nid"])
-            if not note:
+        for card_id, nid, did, ord_index in card_rows:
+            note = notes.get(nid)
+            if note is None:
                 continue
-            model = models.get(str(note[0]))
-            if not model:
+            mid, flds = note
+            if mid not in compiled_models:
+                compiled_models[mid] = _compile_model(models.get(str(mid)))
+            model = compiled_models[mid]
+            if model is None:
                 continue
-            templates: Iterable[Mapping[str, str]] = model.get("tmpls", [])
-            templates = list(templates)
-            ord_index = row["ord"]
-            if ord_index >= len(templates):
+            if ord_index >= len(model.templates):
                 continue
 
-            template = templates[ord_index]
-            field_names = [fld.get("name", "") for fld in model.get("flds", [])]
-            values = note[1]
-            field_map = {
-                name: values[idx] if idx < len(values) else ""
-                for idx, name in enumerate(field_names)
-            }
-
-            css = model.get("css", "")
-            front = render_template(template.get("qfmt", ""), field_map, media_map=media_bytes)
-            back = render_template(
-                template.get("afmt", ""),
-                field_map,
-                media_map=media_bytes,
-                front_side=front,
+            template_name, qfmt, afmt = model.templates[ord_index]
+            field_map = field_maps.get(nid)
+            if field_map is None:
+                values = flds.split("\x1f")
+                field_map = field_maps[nid] = {
+                    name: values[idx] if idx < len(values) else ""
+                    for idx, name in enumerate(model.field_names)
+                }
+
+            css = model.css
+            front = qfmt.render(field_map, media_map=media_bytes, encoded=encoded)
+            back = afmt.render(
+                field_map, media_map=media_bytes, front_side=front, encoded=encoded
             )
-            back_only = render_template(
-                template.get("afmt", ""),
-                field_map,
-                media_map=media_bytes,
-                front_side="",
+            back_only = afmt.render(
+                field_map, media_map=media_bytes, front_side="", encoded=encoded
             )
             summary = _summarise_front(front)
-            deck_name = deck_names.get(row["did"], f"Deck {row['did']}")
+            deck_name = deck_names.get(did, f"Deck {did}")
             cards.append(
                 PreviewCard(
-                    card_id=row["id"],
-                    deck_id=row["did"],
+                    card_id=card_id,
+                    deck_id=did,
                     deck_name=deck_name,
-                    note_id=row["nid"],
-                    template_name=str(template.get("name", f"Card {ord_index}")),
+                    note_id=nid,
+                    template_name=template_name,
                     front_html=front,
                     back_html=back,
                     back_only_html=back_only,
@@ -197,6 +304,57 @@ def _load_collection(collection_path: Path, media_bytes: Mapping[str, bytes]) ->
         conn.close()
 
 
+def _parse_nodes(template: str) -> Optional[Tuple[Any, ...]]:
+    """Split ``template`` into a section tree in one pass over its tags."""
+
+    root: List[Any] = []
+    stack: List[Tuple[str, bool, List[Any]]] = []
+    current = root
+    pos = 0
+    for match in FIELD_RE.finditer(template):
+        if match.start() > pos:
+            current.append(template[pos : match.start()])
+        pos = match.end()
+        expr = match.group(1)
+        kind, name = expr[0], expr[1:]
+        if kind not in "#^/":
+            current.append(_Field(expr))
+            continue
+        # Spaced or empty section names and stray/mismatched closers are left
+        # to the rescanning renderer, which handles them the historical way.
+        if not name or name != name.strip():
+            return None
+        if kind == "/":
+            if not stack or stack[-1][0] != name:
+                return None
+            field, inverted, children = stack.pop()
+            current = stack[-1][2] if stack else root
+            current.append(_Section(field, inverted, tuple(children)))
+        else:
+            current = []
+            stack.append((name, kind == "^", current))
+    if stack:
+        return None
+    if pos < len(template):
+        current.append(template[pos:])
+    return tuple(root)
+
+
+def _render_nodes(
+    nodes: Tuple[Any, ...], fields: Mapping[str, str], front_side: str, out: List[str]
+) -> None:
+    for node in nodes:
+        if isinstance(node, str):
+            out.append(node)
+        elif isinstance(node, _Field):
+            if node.expr == "FrontSide":
+                out.append(front_side)
+            else:
+                out.append(_render_field(node.expr, fields))
+        elif bool(fields.get(node.field, "").strip()) != node.inverted:
+            _render_nodes(node.children, fields, front_side, out)
+
+
 def _render_sections(template: str, fields: Mapping[str, str]) -> str:
     text = template
     while True:
@@ -246,7 +404,11 @@ def _extract_section(text: str, field: str, start: int) -> Tuple[int, str]:
 
 
 def _replace_field(match: re.Match[str], fields: Mapping[str, str]) -> str:
-    expr = match.group(1).strip()
+    return _render_field(match.group(1), fields)
+
+
+def _render_field(raw_expr: str, fields: Mapping[str, str]) -> str:
+    expr = raw_expr.strip()
     if not expr:
         return ""
 
@@ -274,29 +436,43 @@ def _apply_cloze(value: str) -> str:
     return CLOZE_RE.sub(lambda m: f"<span class='cloze'>{m.group(1)}</span>", value)
 
 
-def _replace_sound_refs(text: str, media_map: Mapping[str, bytes]) -> str:
+def _replace_sound_refs(
+    text: str, media_map: Mapping[str, bytes], encoded: Dict[str, str]
+) -> str:
+    if "[sound:" not in text:
+        return text
+
     def _replace(match: re.Match[str]) -> str:
         filename = match.group(1)
+        tag = encoded.get(filename)
+        if tag is not None:
+            return tag
         data = media_map.get(filename)
         if not data:
             return f"<span class=\"missing-media\">[sound:{html.escape(filename)}]</span>"
-        mime, _ = mimetypes.guess_type(filename)
-        mime = mime or "application/octet-stream"
-        encoded = base64.b64encode(data).decode("ascii")
-        return (
-            "<audio controls preload='metadata' style=\"width:100%; margin-top:0.5rem;\">"
-            f"<source src='data:{mime};base64,{encoded}'>"
-            "Your browser does not support audio playback."
-            "</audio>"
-        )
+        tag = encoded[filename] = _audio_tag(filename, data)
+        return tag
 
     return SOUND_RE.sub(_replace, text)
 
 
+def _audio_tag(filename: str, data: bytes) -> str:
+    mime, _ = mimetypes.guess_type(filename)
+    mime = mime or "application/octet-stream"
+    encoded = base64.b64encode(data).decode("ascii")
+    return (
+        "<audio controls preload='metadata' style=\"width:100%; margin-top:0.5rem;\">"
+        f"<source src='data:{mime};base64,{encoded}'>"
+        "Your browser does not support audio playback."
+        "</audio>"
+    )
+
+
 def _summarise_front(text: str) -> str:
-    clean = re.sub(r"<(script|style)[^>]*>.*?</\1>", "", text, flags=re.DOTALL | re.IGNORECASE)
-    clean = re.sub(r"<[^>]+>", " ", clean)
+    clean = text
+    if "<" in clean:
+        clean = _TAG_RE.sub(" ", _SCRIPT_STYLE_RE.sub("", clean))
     clean = html.unescape(clean)
-    clean = re.sub(r"\s+", " ", clean).strip()
+    clean = _WHITESPACE_RE.sub(" ", clean).strip()
     return clean[:140] + ("…" if len(clean) > 140 else "")
 
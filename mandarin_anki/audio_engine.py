@@ -2,7 +2,12 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+import hashlib
+import os
 from pathlib import Path
+import shutil
+import tempfile
+import uuid
 from typing import Optional, Sequence
 
 from .builder import (
@@ -12,6 +17,7 @@ from .builder import (
     TTSLike,
     _ensure_ffmpeg,
     _render_audio,
+    _scratch_root,
 )
 
 
@@ -20,7 +26,8 @@ class AudioGenerationConfig:
     """Configuration options for :func:`generate_audio_from_text`."""
 
     text: str
-    output_path: Path
+    # ``None`` leaves the clip in ``cache_dir`` and returns the cached file.
+    output_path: Optional[Path]
     speaker_wav: Path
     tts_model_name: str
     tts_lang: str
@@ -31,6 +38,14 @@ class AudioGenerationConfig:
     bitrate: str = "192k"
     audio_format: str = "mp3"
     device_preference: Sequence[str] = ("cuda", "cpu")
+    tts_fp16: bool = True
+    # Directory of previously generated clips keyed by their inputs; ``None``
+    # disables the cache. Least recently used clips are evicted past the limit.
+    # A freshly rendered clip is hard-linked into the cache when both sit on one
+    # filesystem, so replace ``output_path`` rather than editing it in place;
+    # cache hits are copied out.
+    cache_dir: Optional[Path] = None
+    cache_max_bytes: int = 200 * 1024 * 1024
 
 
 class _AudioConfigProxy:
@@ -44,12 +59,14 @@ class _AudioConfigProxy:
         volume_ambient_db: float,
         bitrate: str,
         audio_format: str,
+        tts_fp16: bool,
     ) -> None:
         self.tts_lang = tts_lang
         self.volume_voice_db = volume_voice_db
         self.volume_ambient_db = volume_ambient_db
         self.bitrate = bitrate
         self.audio_format = audio_format
+        self.tts_fp16 = tts_fp16
 
 
 def _prepare_tts(
@@ -68,6 +85,68 @@ def _prepare_tts(
     return tts
 
 
+def _file_digest(path: Optional[Path]) -> str:
+    if path is None:
+        return ""
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def _cache_key(config: AudioGenerationConfig, text: str, speaker: Path, ambient: Optional[Path]) -> str:
+    parts = [
+        text,
+        _file_digest(speaker),
+        _file_digest(ambient),
+        config.tts_model_name,
+        config.tts_lang,
+        repr(config.volume_voice_db),
+        repr(config.volume_ambient_db),
+        config.bitrate,
+        config.audio_format,
+        repr(config.tts_fp16),
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _evict_lru(cache_dir: Path, max_bytes: int) -> None:
+    """Delete the least recently used clips until the cache fits ``max_bytes``."""
+
+    entries = []
+    for path in cache_dir.iterdir():
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        if path.is_file():
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            path.unlink()
+        except OSError:  # pragma: no cover - best effort eviction
+            continue
+        total -= size
+
+
+def _place_file(source: Path, target: Path, *, link: bool) -> None:
+    """Atomically place ``source`` at ``target``, hard-linking when ``link`` is set.
+
+    Links fall back to a copy across filesystems.
+    """
+
+    partial = target.with_name(f"{target.name}.{uuid.uuid4().hex}.part")
+    if link:
+        try:
+            os.link(source, partial)
+        except OSError:
+            link = False
+    if not link:
+        shutil.copyfile(source, partial)
+    os.replace(partial, target)
+
+
 def generate_audio_from_text(
     config: AudioGenerationConfig,
     *,
@@ -87,9 +166,33 @@ def generate_audio_from_text(
     if ambient is not None and not ambient.exists():
         ambient = None
 
-    output_path = config.output_path.expanduser()
+    cache_file: Optional[Path] = None
+    if config.cache_dir is not None:
+        cache_dir = config.cache_dir.expanduser()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        cache_file = cache_dir / f"{_cache_key(config, text, speaker, ambient)}.{config.audio_format}"
+
+    if config.output_path is not None:
+        output_path = config.output_path.expanduser()
+    elif cache_file is not None:
+        output_path = cache_file
+    else:
+        raise DeckBuildError("Isi output_path atau cache_dir untuk menyimpan audio.")
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
+    if cache_file is not None:
+        if cache_file.exists():
+            # Recency for LRU eviction is tracked through the mtime.
+            os.utime(cache_file)
+            if cache_file != output_path:
+                # Hits are copied so later writes to the output cannot reach
+                # the cache entry shared by every other hit.
+                _place_file(cache_file, output_path, link=False)
+            return output_path
+        # An earlier store may have left ``output_path`` hard-linked to a cached
+        # clip; rendering into it in place would overwrite the cache entry.
+        output_path.unlink(missing_ok=True)
+
     _ensure_ffmpeg(config.ffmpeg_path)
 
     factory = tts_factory or DefaultTTSFactory()
@@ -99,24 +202,36 @@ def generate_audio_from_text(
         device_preference=config.device_preference,
     )
 
-    tmp_wav = output_path.with_name(f"{output_path.stem}_tmp.wav")
     proxy = _AudioConfigProxy(
         tts_lang=config.tts_lang,
         volume_voice_db=config.volume_voice_db,
         volume_ambient_db=config.volume_ambient_db,
         bitrate=config.bitrate,
         audio_format=config.audio_format,
+        tts_fp16=config.tts_fp16,
     )
 
-    _render_audio(
-        tts=tts,
-        text=text,
-        tmp_wav=tmp_wav,
-        speaker_wav=speaker,
-        ambient_wav=ambient,
-        config=proxy,
-        final_path=output_path,
-    )
+    with tempfile.TemporaryDirectory(prefix="mandarin_anki_", dir=_scratch_root()) as scratch:
+        # Clips kept only in the cache are rendered aside first, so a failed
+        # encode never leaves a partial entry that later hits would serve.
+        in_cache = output_path == cache_file
+        final_path = Path(scratch) / output_path.name if in_cache else output_path
+        _render_audio(
+            tts=tts,
+            text=text,
+            tmp_wav=Path(scratch) / f"{output_path.stem}_tmp.wav",
+            speaker_wav=speaker,
+            ambient_wav=ambient,
+            config=proxy,
+            final_path=final_path,
+        )
+        if in_cache:
+            _place_file(final_path, output_path, link=False)
+
+    if cache_file is not None:
+        if cache_file != output_path:
+            _place_file(output_path, cache_file, link=True)
+        _evict_lru(cache_file.parent, config.cache_max_bytes)
 
     return output_path
 
@@ -1,20 +1,58 @@
 """Core logic for building Mandarin Anki decks."""
 from __future__ import annotations
 
-from dataclasses import dataclass, field
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass, field, replace
 from datetime import datetime
 import csv
-import random
+import hashlib
+import io
+import itertools
+import json
 import re
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import wave
+import weakref
+import zipfile
 from pathlib import Path
 import os
-from typing import Callable, Dict, List, Optional, Protocol, Sequence
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Protocol, Sequence, Set, Tuple
 
 import genanki
+import numpy as np
 from pydub import AudioSegment
 
+try:  # Optional: only speeds up serialising the .apkg media manifest.
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
 
 PRE_ROLL_AMBIENT_MS = 150
+XTTS_SAMPLE_RATE = 24000
+SYNTH_CACHE_FILENAME = ".synth_cache.json"
+
+# A run of separators (plus surrounding whitespace) collapses into one ``<br>``.
+_LITERAL_SEPARATOR_RE = re.compile(r"\s*[，,；;](?:\s*[，,；;])*\s*")
+_REPEATED_BR_RE = re.compile(r"(?:<br>\s*){2,}")
+_LEADING_BR_RE = re.compile(r"^(?:<br>)+")
+_TRAILING_BR_RE = re.compile(r"(?:<br>)+$")
+
+# Audio codecs already compress their payload; deflating them again only costs CPU.
+_COMPRESSED_MEDIA_SUFFIXES = frozenset({".mp3", ".ogg", ".opus", ".m4a"})
 
 
 DEFAULT_COLUMNS: Dict[str, str] = {
@@ -57,13 +95,28 @@ class TTSFactory(Protocol):
         ...
 
 
+_TTS_MODELS: Dict[str, TTSLike] = {}
+_TTS_MODELS_LOCK = threading.Lock()
+
+
 class DefaultTTSFactory:
-    """Factory that instantiates the Coqui `TTS` class on demand."""
+    """Factory that loads Coqui `TTS` models once per process and reuses them."""
 
     def create(self, model_name: str) -> TTSLike:  # pragma: no cover - thin wrapper
-        from TTS.api import TTS
+        with _TTS_MODELS_LOCK:
+            model = _TTS_MODELS.get(model_name)
+            if model is None:
+                from TTS.api import TTS
 
-        return TTS(model_name)
+                model = _TTS_MODELS[model_name] = TTS(model_name)
+        return model
+
+
+def clear_tts_cache() -> None:
+    """Release the models kept by :class:`DefaultTTSFactory`."""
+
+    with _TTS_MODELS_LOCK:
+        _TTS_MODELS.clear()
 
 
 @dataclass(frozen=True)
@@ -110,6 +163,16 @@ class DeckBuildConfig:
     bitrate: str = "192k"
     audio_format: str = "mp3"
     device_preference: Sequence[str] = ("cuda", "cpu")
+    # Processes used to mix and encode clips; ``None`` uses ``os.cpu_count()``.
+    encode_workers: Optional[int] = None
+    # Run TTS inference under fp16 autocast when the model sits on a CUDA device.
+    tts_fp16: bool = True
+    # Already-open binary CSV (e.g. an upload) read instead of ``csv_path``;
+    # ``csv_path`` still names the deck and its audio files.
+    csv_stream: Optional[IO[bytes]] = None
+    # Compile the XTTS GPT decoder with ``torch.compile`` (CUDA only, opt-in:
+    # the first clip pays a long compile and it needs a working Triton setup).
+    tts_compile: bool = False
 
 
 class DeckBuildError(RuntimeError):
@@ -134,11 +197,12 @@ def _literal_to_br(text: str, enable: bool) -> str:
     if not s:
         return ""
 
-    s = re.sub(r"\s*[，,；;]\s*", "<br>", s)
-    s = re.sub(r"(?:<br>\s*){2,}", "<br>", s).strip()
-    s = re.sub(r"^(<br>)+", "", s)
-    s = re.sub(r"(<br>)+$", "", s)
-    return s
+    has_markup = "<br>" in s
+    s = _LITERAL_SEPARATOR_RE.sub("<br>", s)
+    if has_markup:
+        # Only hand-written ``<br>`` tags can still sit next to a generated one.
+        s = _REPEATED_BR_RE.sub("<br>", s).strip()
+    return _TRAILING_BR_RE.sub("", _LEADING_BR_RE.sub("", s))
 
 
 def _ensure_ffmpeg(path: Optional[Path]) -> None:
@@ -174,20 +238,67 @@ def _notify(callback: Optional[ProgressCallback], stage: str, *, current: int =
     callback(ProgressEvent(stage=stage, current=current, total=total, message=message))
 
 
-def _read_rows(config: DeckBuildConfig) -> List[Dict[str, str]]:
-    if not config.csv_path.exists():
+@contextmanager
+def _open_csv(config: DeckBuildConfig) -> Iterator[IO[str]]:
+    """Open the CSV as text, from ``csv_stream`` when given or else ``csv_path``."""
+
+    if config.csv_stream is None:
+        with open(config.csv_path, newline="", encoding=config.encoding) as handle:
+            yield handle
+        return
+
+    config.csv_stream.seek(0)
+    handle = io.TextIOWrapper(config.csv_stream, encoding=config.encoding, newline="")
+    try:
+        yield handle
+    finally:
+        # Leave the caller's stream open.
+        handle.detach()
+
+
+def _count_rows(config: DeckBuildConfig) -> int:
+    """Count the CSV data rows without building a dict per row."""
+
+    if config.csv_stream is None and not config.csv_path.exists():
         raise DeckBuildError(f"CSV tidak ditemukan: {config.csv_path}")
 
-    with open(config.csv_path, newline="", encoding=config.encoding) as handle:
-        reader = csv.DictReader(handle, delimiter=config.delimiter)
-        fieldnames = [_clean(name) for name in (reader.fieldnames or [])]
-        reader.fieldnames = fieldnames
-        rows = [{_clean(k): _clean(v) for k, v in raw.items()} for raw in reader]
+    with _open_csv(config) as handle:
+        reader = csv.reader(handle, delimiter=config.delimiter)
+        next(reader, None)
+        # ``csv.DictReader`` skips blank records, so they are not counted either.
+        total = sum(1 for record in reader if record)
 
-    if not rows:
+    if not total:
         raise DeckBuildError("CSV kosong atau tidak memiliki baris data.")
 
-    return rows
+    return total
+
+
+def _iter_rows(config: DeckBuildConfig, columns: Dict[str, str]) -> Iterator[List[str]]:
+    """Yield the cleaned cells of each CSV row, ordered like ``DEFAULT_COLUMNS``.
+
+    Only the mapped columns are cleaned; missing columns and short rows yield
+    empty strings. Duplicate headers resolve to the last one, as with
+    ``csv.DictReader``.
+    """
+
+    with _open_csv(config) as handle:
+        reader = csv.reader(handle, delimiter=config.delimiter)
+        header = next(reader, [])
+        positions = {_clean(name): pos for pos, name in enumerate(header)}
+        indices = [positions.get(columns[key], -1) for key in DEFAULT_COLUMNS]
+        for record in reader:
+            if not record:
+                continue
+            width = len(record)
+            yield [_clean(record[pos]) if 0 <= pos < width else "" for pos in indices]
+
+
+def _stable_id(*parts: str) -> int:
+    """Derive a genanki model/deck id in ``[2**30, 2**31)`` from ``parts``."""
+
+    digest = hashlib.sha1("\x1f".join(parts).encode("utf-8")).digest()
+    return (1 << 30) | (int.from_bytes(digest[:4], "big") & ((1 << 30) - 1))
 
 
 def _validate_columns(columns: Dict[str, str]) -> Dict[str, str]:
@@ -196,17 +307,400 @@ def _validate_columns(columns: Dict[str, str]) -> Dict[str, str]:
     return mapping
 
 
-def _load_audio(path: Path, volume_db: float) -> AudioSegment:
-    segment = AudioSegment.from_wav(path)
-    return segment + volume_db
+def _read_wav(path: Path) -> Tuple[np.ndarray, int]:
+    """Decode a PCM WAV file into float32 samples shaped ``(frames, channels)``."""
+
+    with wave.open(str(path), "rb") as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        raw = wav.readframes(wav.getnframes())
+
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 3:
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = packed[:, 0] | (packed[:, 1] << 8) | (packed[:, 2] << 16)
+        samples = ((values << 8) >> 8).astype(np.float32) / 8388608.0
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:  # pragma: no cover - the wave module rejects other widths already
+        raise DeckBuildError(f"Format WAV tidak didukung ({width * 8}-bit): {path}")
+    return samples.reshape(-1, channels), rate
+
+
+def _resample(samples: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+    if source_rate == target_rate or len(samples) == 0:
+        return samples
+    frames = max(1, int(round(len(samples) * target_rate / source_rate)))
+    positions = np.arange(frames, dtype=np.float64) * (source_rate / target_rate)
+    index = np.arange(len(samples), dtype=np.float64)
+    return np.stack(
+        [np.interp(positions, index, samples[:, ch]) for ch in range(samples.shape[1])],
+        axis=1,
+    ).astype(np.float32)
+
+
+def _db_to_gain(volume_db: float) -> float:
+    return float(10 ** (volume_db / 20))
+
+
+class _AmbientBed:
+    """Gain-adjusted ambient loop, resampled and tiled on demand per clip."""
+
+    def __init__(self, path: Path, volume_db: float) -> None:
+        samples, self.rate = _read_wav(path)
+        self._units: Dict[int, np.ndarray] = {self.rate: samples * _db_to_gain(volume_db)}
+        self._tiled: Dict[int, np.ndarray] = {}
+
+    def covering(self, rate: int, frames: int) -> np.ndarray:
+        """Return at least ``frames`` frames of the looped bed at ``rate``."""
+
+        unit = self._units.get(rate)
+        if unit is None:
+            unit = self._units[rate] = _resample(self._units[self.rate], self.rate, rate)
+        if len(unit) == 0:
+            return np.zeros((frames, unit.shape[1]), dtype=np.float32)
+        bed = self._tiled.get(rate, unit)
+        if len(bed) < frames:
+            bed = self._tiled[rate] = np.tile(unit, ((frames // len(unit)) + 1, 1))
+        return bed
+
+
+# Ambient beds keyed by (path, mtime, gain). Each process decodes the ambient
+# file once per build and only re-tiles it when a clip longer than any seen so
+# far needs covering.
+_AMBIENT_BEDS: Dict[Tuple[str, int, float], _AmbientBed] = {}
+
+
+def _ambient_bed(path: Path, volume_db: float) -> _AmbientBed:
+    key = (str(path), path.stat().st_mtime_ns, volume_db)
+    bed = _AMBIENT_BEDS.get(key)
+    if bed is None:
+        _AMBIENT_BEDS.clear()
+        bed = _AMBIENT_BEDS[key] = _AmbientBed(path, volume_db)
+    return bed
+
+
+def _export_pcm(pcm: np.ndarray, rate: int, final_path: Path, config: DeckBuildConfig) -> None:
+    """Write interleaved int16 samples to ``final_path`` in ``config.audio_format``."""
+
+    channels = pcm.shape[1]
+    if config.audio_format == "wav":
+        with wave.open(str(final_path), "wb") as wav:
+            wav.setnchannels(channels)
+            wav.setsampwidth(2)
+            wav.setframerate(rate)
+            wav.writeframes(pcm.tobytes())
+        return
+
+    converter = getattr(AudioSegment, "converter", None) or "ffmpeg"
+    command = [
+        str(converter),
+        "-y",
+        "-loglevel",
+        "error",
+        "-f",
+        "s16le",
+        "-ar",
+        str(rate),
+        "-ac",
+        str(channels),
+        "-i",
+        "pipe:0",
+        "-b:a",
+        config.bitrate,
+        "-f",
+        config.audio_format,
+        str(final_path),
+    ]
+    try:
+        process = subprocess.run(command, input=pcm.tobytes(), capture_output=True)
+    except FileNotFoundError as exc:
+        hint = (
+            "Pastikan FFmpeg terinstal dan path-nya benar."
+            if converter == "ffmpeg"
+            else f"Pastikan FFmpeg dapat dijalankan dari: {converter}"
+        )
+        raise FileNotFoundError(f"Gagal mengekspor audio melalui FFmpeg. {hint}") from exc
+    if process.returncode != 0:
+        detail = process.stderr.decode("utf-8", errors="replace").strip().splitlines()
+        raise RuntimeError(
+            "FFmpeg gagal mengekspor audio"
+            + (f": {detail[-1]}" if detail else f" (kode {process.returncode}).")
+        )
+
+
+def _xtts_model(tts: TTSLike) -> Optional[Any]:
+    """Return the underlying XTTS model when ``tts`` exposes the low-level API."""
+
+    model = getattr(getattr(tts, "synthesizer", None), "tts_model", None)
+    if callable(getattr(model, "get_conditioning_latents", None)) and callable(
+        getattr(model, "inference", None)
+    ):
+        return model
+    return None
+
+
+def _output_sample_rate(model: Any) -> int:
+    audio_config = getattr(getattr(model, "config", None), "audio", None)
+    return int(getattr(audio_config, "output_sample_rate", 0) or XTTS_SAMPLE_RATE)
+
+
+def _scratch_root() -> Optional[str]:
+    """Prefer a RAM-backed directory for scratch WAVs, else the OS temp dir."""
+
+    shm = Path("/dev/shm")
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        return str(shm)
+    return None
+
+
+def _as_voice(samples: Any) -> np.ndarray:
+    """Shape mono float TTS output as a ``(frames, 1)`` float32 array."""
+
+    return np.asarray(samples, dtype=np.float32).reshape(-1, 1)
+
+
+def _module_device(module: Any) -> Optional[str]:
+    """Return the device type (``"cuda"``, ``"cpu"``) of a torch module's weights."""
+
+    parameters = getattr(module, "parameters", None)
+    if not callable(parameters):
+        return None
+    try:
+        return next(iter(parameters())).device.type
+    except Exception:
+        return None
+
+
+def _inference_context(tts: TTSLike, fp16: bool) -> Callable[[], Any]:
+    """Return a factory for the context each synthesis call runs in.
+
+    Torch models run under ``torch.inference_mode``, which also skips the
+    autograd version counters that ``no_grad`` still maintains. With ``fp16``
+    on a CUDA model ``torch.autocast`` in half precision is added, which runs
+    the attention and convolution kernels on tensor cores while autocast keeps
+    numerically sensitive ops in fp32. Anything else gets a no-op context.
+    """
+
+    device = _module_device(tts)
+    if device is None:
+        return nullcontext
+    try:
+        import torch
+    except ImportError:  # pragma: no cover - torch modules imply torch
+        return nullcontext
+    if not fp16 or device != "cuda":
+        return torch.inference_mode
+
+    @contextmanager
+    def _half_precision() -> Iterator[None]:
+        with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.float16):
+            yield
+
+    return _half_precision
+
+
+def _compile_decoder(tts: TTSLike) -> None:
+    """Compile the XTTS GPT decoder step for CUDA graphs, at most once per model.
+
+    The autoregressive decoder launches many small kernels per token;
+    ``reduce-overhead`` mode captures them into CUDA graphs that are replayed
+    for every following clip. Only ``forward`` of the inference model is
+    compiled because ``generate`` calls it once per token. Any failure leaves
+    the model in eager mode.
+    """
+
+    model = _xtts_model(tts)
+    decoder = getattr(getattr(model, "gpt", None), "gpt_inference", None)
+    if decoder is None or _module_device(tts) != "cuda" or getattr(decoder, "_compiled_forward", False):
+        return
+    try:
+        import torch
+
+        torch.backends.cudnn.benchmark = True
+        decoder.forward = torch.compile(decoder.forward, mode="reduce-overhead", fullgraph=False)
+        decoder._compiled_forward = True
+    except Exception:  # pragma: no cover - depends on the torch/Triton install
+        return
+
+
+# XTTS conditioning latents per model instance, keyed by a hash of the speaker
+# WAV. A model kept alive by the app reuses them across builds and quick audio
+# clips, even when the same reference is re-uploaded to a new temp path.
+_SPEAKER_LATENTS: "weakref.WeakKeyDictionary[Any, Dict[str, Tuple[Any, Any]]]" = weakref.WeakKeyDictionary()
+_SPEAKER_LATENTS_PER_MODEL = 8
+
+
+# One lock per TTS model. Cached models are shared by every build, thread and
+# app session, and XTTS inference (and its latent cache) is not thread-safe.
+_SYNTHESIS_LOCKS: "weakref.WeakKeyDictionary[Any, threading.Lock]" = weakref.WeakKeyDictionary()
+_SYNTHESIS_LOCKS_GUARD = threading.Lock()
+_SHARED_SYNTHESIS_LOCK = threading.Lock()
+
+
+def _synthesis_lock(tts: TTSLike) -> threading.Lock:
+    with _SYNTHESIS_LOCKS_GUARD:
+        try:
+            lock = _SYNTHESIS_LOCKS.get(tts)
+            if lock is None:
+                lock = _SYNTHESIS_LOCKS[tts] = threading.Lock()
+        except TypeError:  # pragma: no cover - model cannot be weakly referenced
+            lock = _SHARED_SYNTHESIS_LOCK
+    return lock
+
+
+# Settings ``Xtts.synthesize`` (behind ``tts_to_file``) reads from the model
+# config; the low-level calls need them passed explicitly to sound the same.
+_XTTS_SAMPLING_SETTINGS = {
+    name: name for name in ("temperature", "length_penalty", "repetition_penalty", "top_k", "top_p")
+}
+_XTTS_CONDITIONING_SETTINGS = {
+    "gpt_cond_len": "gpt_cond_len",
+    "gpt_cond_chunk_len": "gpt_cond_chunk_len",
+    "max_ref_len": "max_ref_length",
+    "sound_norm_refs": "sound_norm_refs",
+}
+
+
+def _config_settings(model: Any, names: Dict[str, str]) -> Dict[str, Any]:
+    """Map model config attributes to keyword arguments, skipping unset ones."""
+
+    config = getattr(model, "config", None)
+    settings = {}
+    for attribute, keyword in names.items():
+        value = getattr(config, attribute, None)
+        if value is not None:
+            settings[keyword] = value
+    return settings
+
 
+def _conditioning_latents(model: Any, speaker_wav: Path) -> Tuple[Any, Any]:
+    digest = hashlib.sha1(speaker_wav.read_bytes()).hexdigest()
+    try:
+        cache = _SPEAKER_LATENTS.setdefault(model, {})
+    except TypeError:  # pragma: no cover - model cannot be weakly referenced
+        cache = {}
+    latents = cache.get(digest)
+    if latents is None:
+        latents = model.get_conditioning_latents(
+            audio_path=str(speaker_wav), **_config_settings(model, _XTTS_CONDITIONING_SETTINGS)
+        )
+        if len(cache) >= _SPEAKER_LATENTS_PER_MODEL:
+            cache.pop(next(iter(cache)))
+        cache[digest] = latents
+    return latents
+
+
+class _SpeakerSynthesizer:
+    """Synthesise clips for one speaker straight into memory.
+
+    The high-level ``tts_to_file`` API re-encodes the reference speaker WAV for
+    every sentence and round-trips each clip through a WAV file. When the model
+    exposes XTTS' ``get_conditioning_latents`` and ``inference`` methods we
+    compute the latents on first use and reuse them for every subsequent clip.
+    Other models use the in-memory ``tts`` API when available and only fall
+    back to ``tts_to_file`` (through a scratch WAV) when it is not.
+    """
+
+    def __init__(self, tts: TTSLike, *, speaker_wav: Path, language: str, fp16: bool = False) -> None:
+        self._tts = tts
+        self._speaker_wav = speaker_wav
+        self._language = language
+        self._model = _xtts_model(tts)
+        self._sampling = _config_settings(self._model, _XTTS_SAMPLING_SETTINGS)
+        self._latents: Optional[Tuple[Any, Any]] = None
+        self._inference_context = _inference_context(tts, fp16)
+        self._lock = _synthesis_lock(tts)
+
+    def synthesize(self, text: str, *, tmp_wav: Path) -> Tuple[np.ndarray, int]:
+        """Return the voice samples for ``text`` and their sample rate.
+
+        ``tmp_wav`` is only written (and removed again) for models that lack an
+        in-memory synthesis API. Calls on the same model run one at a time.
+        """
+
+        with self._lock:
+            return self._synthesize(text, tmp_wav=tmp_wav)
+
+    def _synthesize(self, text: str, *, tmp_wav: Path) -> Tuple[np.ndarray, int]:
+        if self._model is not None:
+            if self._latents is None:
+                # Conditioning latents stay in full precision; they are computed once.
+                self._latents = _conditioning_latents(self._model, self._speaker_wav)
+            gpt_cond_latent, speaker_embedding = self._latents
+            with self._inference_context():
+                output = self._model.inference(
+                    text,
+                    self._language,
+                    gpt_cond_latent,
+                    speaker_embedding,
+                    enable_text_splitting=True,
+                    **self._sampling,
+                )
+            return _as_voice(output["wav"]), _output_sample_rate(self._model)
+
+        synthesizer = getattr(self._tts, "synthesizer", None)
+        sample_rate = getattr(synthesizer, "output_sample_rate", None)
+        if callable(getattr(self._tts, "tts", None)) and sample_rate:
+            with self._inference_context():
+                samples = self._tts.tts(
+                    text=text,
+                    speaker_wav=str(self._speaker_wav),
+                    language=self._language,
+                    split_sentences=True,
+                )
+            return _as_voice(samples), int(sample_rate)
+
+        with self._inference_context():
+            self._tts.tts_to_file(
+                text=text,
+                speaker_wav=str(self._speaker_wav),
+                language=self._language,
+                file_path=tmp_wav,
+                split_sentences=True,
+            )
+        try:
+            return _read_wav(tmp_wav)
+        finally:
+            try:
+                tmp_wav.unlink(missing_ok=True)
+            except Exception:  # pragma: no cover - best effort cleanup
+                pass
+
+
+def _mix_and_export(
+    *,
+    voice: np.ndarray,
+    voice_rate: int,
+    ambient_wav: Optional[Path],
+    config: DeckBuildConfig,
+    final_path: Path,
+) -> None:
+    rate = voice_rate
+    voice = voice * _db_to_gain(config.volume_voice_db)
 
-def _make_silence(duration_ms: int) -> AudioSegment:
-    silent_factory = getattr(AudioSegment, "silent", None)
-    if callable(silent_factory):
-        return silent_factory(duration=duration_ms)
-    # Fallback for the lightweight AudioSegment test stub which lacks ``silent``.
-    return AudioSegment(duration_ms)
+    ambient: Optional[_AmbientBed] = None
+    if ambient_wav and ambient_wav.exists():
+        ambient = _ambient_bed(ambient_wav, config.volume_ambient_db)
+        # Like pydub's overlay, mix at the higher sample rate of the two inputs.
+        if ambient.rate > rate:
+            voice = _resample(voice, rate, ambient.rate)
+            rate = ambient.rate
+
+    pre_roll = rate * PRE_ROLL_AMBIENT_MS // 1000
+    output = np.zeros((pre_roll + len(voice), voice.shape[1]), dtype=np.float32)
+    if ambient is not None:
+        bed = ambient.covering(rate, len(output))
+        if bed.shape[1] > output.shape[1]:
+            output = np.repeat(output, bed.shape[1], axis=1)
+        output += bed[: len(output)]
+    output[pre_roll:] += voice
+    np.clip(output, -1.0, 1.0, out=output)
+    _export_pcm((output * 32767).astype("<i2"), rate, final_path, config)
 
 
 def _render_audio(
@@ -219,46 +713,240 @@ def _render_audio(
     config: DeckBuildConfig,
     final_path: Path,
 ) -> None:
-    tts.tts_to_file(
-        text=text,
-        speaker_wav=str(speaker_wav),
-        language=config.tts_lang,
-        file_path=tmp_wav,
-        split_sentences=True,
+    synthesizer = _SpeakerSynthesizer(
+        tts, speaker_wav=speaker_wav, language=config.tts_lang, fp16=config.tts_fp16
+    )
+    voice, voice_rate = synthesizer.synthesize(text, tmp_wav=tmp_wav)
+    _mix_and_export(
+        voice=voice,
+        voice_rate=voice_rate,
+        ambient_wav=ambient_wav,
+        config=config,
+        final_path=final_path,
     )
 
-    voice = _load_audio(tmp_wav, config.volume_voice_db)
-    ambient_padding = _make_silence(PRE_ROLL_AMBIENT_MS)
-    if ambient_wav and ambient_wav.exists():
-        ambient = _load_audio(ambient_wav, config.volume_ambient_db)
-        required_length = PRE_ROLL_AMBIENT_MS + len(voice)
-        if len(ambient) == 0:
-            ambient = _make_silence(required_length or 1)
-        if len(ambient) < required_length:
-            repeat = (required_length // len(ambient)) + 1
-            ambient = ambient * repeat
-        ambient_overlay = ambient[PRE_ROLL_AMBIENT_MS : PRE_ROLL_AMBIENT_MS + len(voice)]
-        ambient_padding = ambient[:PRE_ROLL_AMBIENT_MS]
-        mixed = voice.overlay(ambient_overlay)
-    else:
-        mixed = voice
-
-    output = ambient_padding + mixed
 
+def _media_manifest(media: Sequence[str]) -> bytes:
+    """Serialise the ``{"0": "clip.mp3", ...}`` map Anki reads from ``media``."""
+
+    manifest = {str(i): os.path.basename(path) for i, path in enumerate(media)}
+    if orjson is not None:
+        return orjson.dumps(manifest)
+    return json.dumps(manifest).encode("utf-8")
+
+
+def _write_apkg(package: Any, apkg_path: Path) -> None:
+    """Write ``package`` to ``apkg_path``, deflating only what compresses well.
+
+    Mirrors ``genanki.Package.write_to_file`` (which stores every entry
+    uncompressed) but deflates the SQLite collection and the media manifest
+    while storing already-compressed audio as-is. Falls back to genanki's own
+    writer when the package does not expose ``write_to_db``.
+    """
+
+    write_to_db = getattr(package, "write_to_db", None)
+    if not callable(write_to_db):
+        package.write_to_file(apkg_path)
+        return
+
+    timestamp = time.time()
+    fd, db_name = tempfile.mkstemp(suffix=".anki2")
+    os.close(fd)
     try:
-        output.export(final_path, format=config.audio_format, bitrate=config.bitrate)
-    except FileNotFoundError as exc:
-        converter = getattr(AudioSegment, "converter", None)
-        hint = (
-            "Pastikan FFmpeg terinstal dan path-nya benar."
-            if converter is None
-            else f"Pastikan FFmpeg dapat dijalankan dari: {converter}"
-        )
-        raise FileNotFoundError(f"Gagal mengekspor audio melalui FFmpeg. {hint}") from exc
-    try:
-        tmp_wav.unlink(missing_ok=True)
-    except Exception:  # pragma: no cover - best effort cleanup
-        pass
+        conn = sqlite3.connect(db_name)
+        try:
+            write_to_db(conn.cursor(), timestamp, itertools.count(int(timestamp * 1000)))
+            conn.commit()
+        finally:
+            conn.close()
+
+        media = list(package.media_files)
+        with zipfile.ZipFile(apkg_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.write(db_name, "collection.anki2")
+            archive.writestr("media", _media_manifest(media))
+            for i, path in enumerate(media):
+                stored = Path(path).suffix.lower() in _COMPRESSED_MEDIA_SUFFIXES
+                archive.write(path, str(i), compress_type=zipfile.ZIP_STORED if stored else None)
+    finally:
+        os.unlink(db_name)
+
+
+def _init_encode_worker(converter: Optional[str], ffprobe: Optional[str]) -> None:
+    """Carry the FFmpeg location configured by :func:`_ensure_ffmpeg` into a worker."""
+
+    if converter:
+        AudioSegment.converter = converter
+        if hasattr(AudioSegment, "ffmpeg"):
+            AudioSegment.ffmpeg = converter
+    if ffprobe and hasattr(AudioSegment, "ffprobe"):
+        AudioSegment.ffprobe = ffprobe
+
+
+class _InlineExecutor(Executor):
+    """Executor that runs each task immediately on the calling thread."""
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as exc:  # pragma: no cover - surfaced through the future
+            future.set_exception(exc)
+        return future
+
+
+def _encode_executor(config: DeckBuildConfig, jobs: int) -> Tuple[Executor, int]:
+    """Return the executor for mixing/encoding and how many workers it runs."""
+
+    if jobs <= 1:
+        return _InlineExecutor(), 1
+    workers = min(config.encode_workers or os.cpu_count() or 1, jobs)
+    if workers <= 1:
+        # A single background thread still overlaps encoding with synthesis:
+        # the TTS model, NumPy and the FFmpeg subprocess all release the GIL.
+        return ThreadPoolExecutor(max_workers=1), 1
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_encode_worker,
+        initargs=(
+            getattr(AudioSegment, "converter", None),
+            getattr(AudioSegment, "ffprobe", None),
+        ),
+    )
+    return executor, workers
+
+
+def _synth_fingerprint(config: DeckBuildConfig) -> str:
+    """Describe every build setting that shapes a clip, apart from its text."""
+
+    parts = [config.tts_model_name, config.tts_lang]
+    for path in (config.speaker_wav, config.ambient_wav):
+        if path and path.exists():
+            parts += [str(path.resolve()), str(path.stat().st_mtime_ns)]
+        else:
+            parts += ["", ""]
+    parts += [
+        repr(config.volume_voice_db),
+        repr(config.volume_ambient_db),
+        config.bitrate,
+        config.audio_format,
+        repr(config.tts_fp16),
+    ]
+    return "\x1f".join(parts)
+
+
+def _synth_key(fingerprint: str, text: str) -> str:
+    return hashlib.sha1(f"{fingerprint}\x1f{text}".encode("utf-8")).hexdigest()
+
+
+class _SynthCache:
+    """Clips from earlier builds in ``output_dir``, keyed by :func:`_synth_key`.
+
+    Entries remember the size and mtime of the clip they point at, so a file
+    that was replaced or edited since is not reused.
+    """
+
+    def __init__(self, output_dir: Path) -> None:
+        self._output_dir = output_dir
+        self._path = output_dir / SYNTH_CACHE_FILENAME
+        try:
+            entries = json.loads(self._path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            entries = {}
+        self._entries: Dict[str, Dict[str, Any]] = entries if isinstance(entries, dict) else {}
+        self._dirty = False
+
+    def lookup(self, key: str) -> Optional[Path]:
+        entry = self._entries.get(key)
+        if not isinstance(entry, dict):
+            return None
+        path = self._output_dir / Path(str(entry.get("file", ""))).name
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        if stat.st_size != entry.get("size") or stat.st_mtime_ns != entry.get("mtime_ns"):
+            return None
+        return path
+
+    def record(self, key: str, path: Path) -> None:
+        try:
+            stat = path.stat()
+        except OSError:
+            return
+        self._entries[key] = {"file": path.name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        self._dirty = True
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        try:
+            self._path.write_text(json.dumps(self._entries), encoding="utf-8")
+        except OSError:  # pragma: no cover - the cache is only an optimisation
+            pass
+
+
+@dataclass(frozen=True)
+class _PendingRow:
+    """A CSV row whose note is built but whose audio still has to be synthesised."""
+
+    idx: int
+    text: str
+    audio_path: Path
+    key: str
+
+
+@dataclass(frozen=True)
+class _CopiedRow:
+    """A CSV row whose audio is a copy of a clip synthesised for identical text."""
+
+    idx: int
+    text: str
+    audio_path: Path
+    key: str
+    source: Path
+    source_idx: Optional[int] = None
+
+
+def _one_writer_per_clip(
+    pending: List[_PendingRow], copies: List[_CopiedRow]
+) -> Tuple[List[_PendingRow], List[_CopiedRow]]:
+    """Keep only the last row, in CSV order, that writes each audio file.
+
+    Rows may share an ``Audio`` filename; written one after another the last
+    row's clip is what remains, so earlier writers are dropped rather than
+    encoded concurrently into the same file. Copies whose source is dropped or
+    overwritten during this build are re-pointed at a kept clip for the same
+    text, or synthesised themselves.
+    """
+
+    owner: Dict[Path, int] = {}
+    for row in sorted([*pending, *copies], key=lambda row: row.idx):
+        owner[row.audio_path] = row.idx
+    kept = [item for item in pending if owner[item.audio_path] == item.idx]
+    kept_idx = {item.idx for item in kept}
+    by_key = {item.key: item for item in kept}
+
+    kept_copies: List[_CopiedRow] = []
+    for dup in copies:
+        if owner[dup.audio_path] != dup.idx:
+            continue
+        if dup.source_idx is not None:
+            valid = dup.source_idx in kept_idx
+        else:
+            valid = dup.source == dup.audio_path or dup.source not in owner
+        if valid:
+            kept_copies.append(dup)
+            continue
+        first = by_key.get(dup.key)
+        if first is not None:
+            kept_copies.append(replace(dup, source=first.audio_path, source_idx=first.idx))
+        else:
+            item = _PendingRow(idx=dup.idx, text=dup.text, audio_path=dup.audio_path, key=dup.key)
+            by_key[dup.key] = item
+            kept_idx.add(item.idx)
+            kept.append(item)
+    kept.sort(key=lambda item: item.idx)
+    return kept, kept_copies
 
 
 def build_anki_deck(
@@ -273,16 +961,14 @@ def build_anki_deck(
         raise DeckBuildError(f"Speaker WAV tidak ditemukan: {config.speaker_wav}")
 
     columns = _validate_columns(config.columns)
-    rows = _read_rows(config)
-    total_rows = len(rows)
+    total_rows = _count_rows(config)
 
     config.output_dir.mkdir(parents=True, exist_ok=True)
     _ensure_ffmpeg(config.ffmpeg_path)
+    ambient_wav = config.ambient_wav if config.ambient_wav and config.ambient_wav.exists() else None
 
     _notify(progress_callback, "init", total=total_rows, message="Menyiapkan deck & model…")
 
-    model_id = random.randrange(1 << 30, 1 << 31)
-    deck_id = random.randrange(1 << 30, 1 << 31)
     timestamp_tag = datetime.now().strftime("deck_%Y%m%d_%H%M%S")
 
     css = """
@@ -313,32 +999,39 @@ def build_anki_deck(
         "afmt": """{{FrontSide}}<hr><div class=\"hanzi\">{{Hanzi}}</div><div class=\"pinyin\">{{Pinyin}}</div><div class=\"audio\">{{AudioMarkup}}</div>""",
     }
 
+    model_name = "CN Sentence (Putonghua)"
+    model_fields = [
+        {"name": "Hanzi"},
+        {"name": "Pinyin"},
+        {"name": "Indo"},
+        {"name": "Literal"},
+        {"name": "LiteralBr"},
+        {"name": "Grammar"},
+        {"name": "Audio"},
+        {"name": "AudioMarkup"},
+        {"name": "Enable_RM"},
+        {"name": "Enable_LT"},
+        {"name": "Enable_MP"},
+        {"name": "Tags"},
+        {"name": "UID"},
+    ]
+    templates = [template_read, template_listen, template_production]
+    # Ids derive from content so re-importing a rebuilt deck updates the same
+    # note type and deck in Anki; changing the note type yields a new id.
+    model_id = _stable_id(model_name, css, json.dumps([model_fields, templates], sort_keys=True))
     model = genanki.Model(
         model_id,
-        "CN Sentence (Putonghua)",
-        fields=[
-            {"name": "Hanzi"},
-            {"name": "Pinyin"},
-            {"name": "Indo"},
-            {"name": "Literal"},
-            {"name": "LiteralBr"},
-            {"name": "Grammar"},
-            {"name": "Audio"},
-            {"name": "AudioMarkup"},
-            {"name": "Enable_RM"},
-            {"name": "Enable_LT"},
-            {"name": "Enable_MP"},
-            {"name": "Tags"},
-            {"name": "UID"},
-        ],
-        templates=[template_read, template_listen, template_production],
+        model_name,
+        fields=model_fields,
+        templates=templates,
         css=css,
     )
 
     base_name = config.csv_path.stem.replace(" ", "_")
-    deck_title = f"Mandarin Grammar ({base_name}) - {timestamp_tag}"
-    deck = genanki.Deck(deck_id, deck_title)
-    media_files: List[Path] = []
+    deck_title = f"Mandarin Grammar ({base_name})"
+    deck = genanki.Deck(_stable_id("deck", base_name), deck_title)
+    # Ordered set: rows that share an audio file must pack it only once.
+    media_files: Dict[Path, None] = {}
     row_errors: List[str] = []
 
     tts_factory = tts_factory or DefaultTTSFactory()
@@ -354,53 +1047,68 @@ def build_anki_deck(
                     break
                 except Exception:
                     continue
+            if config.tts_compile:
+                _compile_decoder(tts_model)
         return tts_model
 
     _notify(progress_callback, "rows", total=total_rows, message="Memproses baris CSV…")
 
-    for idx, row in enumerate(rows, start=1):
+    # Phase 1: build every note and collect the rows that still need audio, so
+    # the TTS phase below can run back-to-back with a single warm speaker state.
+    built: List[Tuple[int, genanki.Note, Path]] = []
+    pending: List[_PendingRow] = []
+    audio_prefix = base_name.lower()
+    audio_ext = f".{config.audio_format}"
+    # Repeated sentences (common in drill decks) are synthesised once and the
+    # clip copied; clips from earlier builds are reused unless regenerating.
+    copies: List[_CopiedRow] = []
+    first_clip: Dict[str, _PendingRow] = {}
+    synth_cache = _SynthCache(config.output_dir)
+    fingerprint = _synth_fingerprint(config)
+    # One directory listing replaces a stat() per row for existing clips.
+    existing_clips: Set[str] = set()
+    if not config.regenerate_audio_if_exists:
+        with os.scandir(config.output_dir) as entries:
+            existing_clips = {os.path.normcase(entry.name) for entry in entries if entry.is_file()}
+    completed = 0
+    # Rows without pending audio finish in microseconds; report them in 1% steps
+    # instead of one callback per row. Synthesised rows below report each clip.
+    row_step = max(1, total_rows // 100)
+    for idx, row in enumerate(_iter_rows(config, columns), start=1):
+        queued = False
         try:
-            hanzi = row.get(columns["Hanzi"], "")
+            (
+                hanzi,
+                pinyin,
+                indo,
+                literal,
+                grammar,
+                audio_name,
+                enable_rm,
+                enable_lt,
+                enable_mp,
+                tags,
+                uid,
+            ) = row
             if not hanzi:
                 row_errors.append(f"Baris {idx}: kolom Hanzi kosong, dilewati.")
                 continue
 
-            pinyin = row.get(columns["Pinyin"], "")
-            indo = row.get(columns["Indo"], "")
-            literal = row.get(columns["Literal"], "")
-            grammar = row.get(columns["Grammar"], "")
-            audio_name = row.get(columns["Audio"], "")
-            enable_rm = row.get(columns["Enable_RM"], "1") or "1"
-            enable_lt = row.get(columns["Enable_LT"], "1") or "1"
-            enable_mp = row.get(columns["Enable_MP"], "1") or "1"
-            tags = row.get(columns["Tags"], "")
-            uid = row.get(columns["UID"], "") or f"{base_name}-{idx:04d}"
+            enable_rm = enable_rm or "1"
+            enable_lt = enable_lt or "1"
+            enable_mp = enable_mp or "1"
+            uid = uid or f"{base_name}-{idx:04d}"
 
             literal_br = _literal_to_br(literal, config.use_literal_linebreaks)
 
             if not audio_name:
-                audio_name = f"{base_name.lower()}_{idx:03d}.{config.audio_format}"
-            elif not audio_name.lower().endswith(f".{config.audio_format}"):
-                audio_name = f"{Path(audio_name).stem}.{config.audio_format}"
+                audio_name = f"{audio_prefix}_{idx:03d}{audio_ext}"
+            elif audio_name[-len(audio_ext):].lower() != audio_ext:
+                audio_name = f"{Path(audio_name).stem}{audio_ext}"
 
             audio_path = config.output_dir / audio_name
 
-            if config.regenerate_audio_if_exists or not audio_path.exists():
-                ensure_tts()
-                tmp_wav = config.output_dir / f"tts_{idx:03d}.wav"
-                _render_audio(
-                    tts=tts_model,
-                    text=hanzi,
-                    tmp_wav=tmp_wav,
-                    speaker_wav=config.speaker_wav,
-                    ambient_wav=config.ambient_wav,
-                    config=config,
-                    final_path=audio_path,
-                )
-
-            media_files.append(audio_path)
-            tag_list = [t for t in (tags or "").split() if t]
-            tag_list.append(timestamp_tag)
+            tag_list = tags.split() + [timestamp_tag] if tags else [timestamp_tag]
 
             note = genanki.Note(
                 model=model,
@@ -420,25 +1128,146 @@ def build_anki_deck(
                     uid,
                 ],
                 tags=tag_list,
+                # The Tags field carries the build timestamp; keying the GUID
+                # on the UID lets a re-import update the note instead.
+                guid=genanki.guid_for(uid),
             )
-            deck.add_note(note)
+            built.append((idx, note, audio_path))
+            if audio_path.parent == config.output_dir:
+                clip_exists = os.path.normcase(audio_name) in existing_clips
+            else:
+                clip_exists = audio_path.exists()
+            if config.regenerate_audio_if_exists or not clip_exists:
+                key = _synth_key(fingerprint, hanzi)
+                first = first_clip.get(key)
+                cached = None if config.regenerate_audio_if_exists else synth_cache.lookup(key)
+                if first is not None:
+                    copies.append(_CopiedRow(idx, hanzi, audio_path, key, first.audio_path, source_idx=first.idx))
+                elif cached is not None:
+                    copies.append(_CopiedRow(idx, hanzi, audio_path, key, cached))
+                else:
+                    item = _PendingRow(idx=idx, text=hanzi, audio_path=audio_path, key=key)
+                    first_clip[key] = item
+                    pending.append(item)
+                    queued = True
         except Exception as exc:  # pragma: no cover - defensive, errors surfaced in UI
             row_errors.append(f"Baris {idx}: {exc}")
         finally:
-            _notify(progress_callback, "row", current=idx, total=total_rows)
+            if not queued:
+                completed += 1
+                if completed % row_step == 0 or completed == total_rows:
+                    _notify(progress_callback, "row", current=completed, total=total_rows)
+
+    queued_rows = len(pending)
+    pending, copies = _one_writer_per_clip(pending, copies)
+    # Dropped writers finish here; copies promoted to synthesis finish in phase 2.
+    completed += queued_rows - len(pending)
+
+    # Phase 2: synthesise the pending clips, reusing the speaker conditioning.
+    failed: Set[int] = set()
+    if pending:
+        _notify(
+            progress_callback,
+            "tts",
+            current=completed,
+            total=total_rows,
+            message=f"Membuat audio untuk {len(pending)} baris…"
+            + (f" ({len(copies)} baris lain memakai ulang audio yang sama)" if copies else ""),
+        )
+        synthesizer = _SpeakerSynthesizer(
+            ensure_tts(),
+            speaker_wav=config.speaker_wav,
+            language=config.tts_lang,
+            fp16=config.tts_fp16,
+        )
+
+        def _finish(item: _PendingRow, error: Optional[BaseException]) -> None:
+            nonlocal completed
+            if error is not None:
+                row_errors.append(f"Baris {item.idx}: {error}")
+                failed.add(item.idx)
+            else:
+                synth_cache.record(item.key, item.audio_path)
+            completed += 1
+            _notify(progress_callback, "row", current=completed, total=total_rows)
+
+        def _collect(futures: Dict[Future, _PendingRow], *, limit: int) -> None:
+            # Finish completed encodes, blocking while more than ``limit`` are in flight.
+            while futures:
+                timeout = None if len(futures) > limit else 0
+                done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    return
+                for future in done:
+                    _finish(futures.pop(future), future.exception())
+
+        # Mixing and encoding is CPU-bound and independent per row, so it runs in
+        # workers while the main thread keeps the TTS model busy. Synthesis waits
+        # once a couple of clips per worker are queued, which bounds how many
+        # voice buffers are held in memory.
+        executor, workers = _encode_executor(config, len(pending))
+        max_in_flight = 2 * workers
+        # Each task pickles its config for the worker; an open CSV stream would
+        # fail to pickle (or ship the whole upload with every clip).
+        encode_config = replace(config, csv_stream=None)
+        with executor, tempfile.TemporaryDirectory(prefix="mandarin_anki_", dir=_scratch_root()) as scratch:
+            futures: Dict[Future, _PendingRow] = {}
+            for item in pending:
+                try:
+                    voice, voice_rate = synthesizer.synthesize(
+                        item.text, tmp_wav=Path(scratch) / f"tts_{item.idx:03d}.wav"
+                    )
+                    future = executor.submit(
+                        _mix_and_export,
+                        voice=voice,
+                        voice_rate=voice_rate,
+                        ambient_wav=ambient_wav,
+                        config=encode_config,
+                        final_path=item.audio_path,
+                    )
+                except Exception as exc:  # pragma: no cover - defensive, errors surfaced in UI
+                    _finish(item, exc)
+                    continue
+                futures[future] = item
+                _collect(futures, limit=max_in_flight - 1)
+            _collect(futures, limit=0)
+
+    for dup in copies:
+        if dup.source_idx in failed:
+            row_errors.append(f"Baris {dup.idx}: audio baris {dup.source_idx} gagal dibuat.")
+            failed.add(dup.idx)
+            continue
+        try:
+            if dup.source != dup.audio_path:
+                shutil.copyfile(dup.source, dup.audio_path)
+        except OSError as exc:  # pragma: no cover - defensive, errors surfaced in UI
+            row_errors.append(f"Baris {dup.idx}: {exc}")
+            failed.add(dup.idx)
+    synth_cache.save()
+
+    # Rows sharing a clip with a failed writer have no audio to pack either.
+    failed_clips = {audio_path for idx, _, audio_path in built if idx in failed}
+    for idx, note, audio_path in built:
+        if idx in failed:
+            continue
+        if audio_path in failed_clips:
+            row_errors.append(f"Baris {idx}: audio {audio_path.name} gagal dibuat.")
+            continue
+        media_files[audio_path] = None
+        deck.add_note(note)
 
     if not deck.notes:
         raise DeckBuildError("Tidak ada kartu yang berhasil dibangun.", row_errors=row_errors)
 
     apkg_name = f"{base_name}_{timestamp_tag}.apkg"
     apkg_path = config.output_dir / apkg_name
-    genanki.Package(deck, [str(p) for p in media_files]).write_to_file(apkg_path)
+    _write_apkg(genanki.Package(deck, [str(p) for p in media_files]), apkg_path)
 
     _notify(progress_callback, "complete", message="Deck selesai dibangun.")
 
     return DeckBuildResult(
         apkg_path=apkg_path,
-        media_files=media_files,
+        media_files=list(media_files),
         rows_processed=len(deck.notes),
         row_errors=row_errors,
     )
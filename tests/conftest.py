@@ -0,0 +1,68 @@
+"""Put the repo on ``sys.path`` and stub ``pydub``/``genanki`` before the tests import the package."""
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def _ensure_stubs() -> None:
+    if "pydub" not in sys.modules:
+        pydub_module = types.ModuleType("pydub")
+
+        class _AudioSegment:
+            # The builder only reads and sets the FFmpeg locations on the class.
+            converter = None
+
+        pydub_module.AudioSegment = _AudioSegment
+        sys.modules["pydub"] = pydub_module
+
+    if "genanki" not in sys.modules:
+        genanki_module = types.ModuleType("genanki")
+
+        class _Note:
+            def __init__(self, *, model, fields, tags, guid=None):
+                self.model = model
+                self.fields = fields
+                self.tags = tags
+                self.guid = guid
+
+        class _Deck:
+            def __init__(self, deck_id: int, title: str):
+                self.deck_id = deck_id
+                self.title = title
+                self.notes = []
+
+            def add_note(self, note: _Note) -> None:
+                self.notes.append(note)
+
+        class _Model:
+            def __init__(self, model_id: int, name: str, fields, templates, css):
+                self.model_id = model_id
+                self.name = name
+                self.fields = fields
+                self.templates = templates
+                self.css = css
+
+        class _Package:
+            def __init__(self, deck: _Deck, media_files):
+                self.deck = deck
+                self.media_files = media_files
+
+            def write_to_file(self, path: Path) -> None:
+                Path(path).write_bytes(b"stub-apkg")
+
+        genanki_module.guid_for = lambda *values: "\x1f".join(str(value) for value in values)
+        genanki_module.Note = _Note
+        genanki_module.Deck = _Deck
+        genanki_module.Model = _Model
+        genanki_module.Package = _Package
+        sys.modules["genanki"] = genanki_module
+
+
+_ensure_stubs()
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import itertools
+
+import pytest
+
+from mandarin_anki import anki_preview
+from mandarin_anki.anki_preview import CompiledTemplate, compile_template, render_template
+
+
+NESTED = "<{{#A}}a{{#B}}[{{B}}]{{/B}}{{^B}}no-b{{/B}}{{/A}}{{^A}}no-a{{/A}}>"
+
+
+@pytest.mark.parametrize(
+    "a, b, expected",
+    [
+        ("x", "y", "<a[y]>"),
+        ("x", "", "<ano-b>"),
+        ("", "y", "<no-a>"),
+        # Whitespace-only fields count as empty, like Anki.
+        ("x", "  ", "<ano-b>"),
+        (" \n", "y", "<no-a>"),
+    ],
+)
+def test_render_nested_sections(a, b, expected):
+    assert render_template(NESTED, {"A": a, "B": b}) == expected
+
+
+def test_compiled_sections_match_the_rescanning_renderer():
+    templates = [
+        NESTED,
+        "{{#A}}{{#A}}twice{{/A}}{{/A}}",
+        "{{^A}}{{#B}}{{B}}{{/B}}{{/A}}|{{text:B}}|{{Missing}}",
+    ]
+    for template, a, b in itertools.product(templates, ("", "x", " "), ("", "<i>y</i>")):
+        fields = {"A": a, "B": b}
+        compiled = compile_template(template)
+        assert compiled.nodes is not None
+        legacy = CompiledTemplate(source=template, nodes=None)
+        assert compiled.render(fields) == legacy.render(fields)
+
+
+def test_render_front_side():
+    template = "{{FrontSide}}<hr id=answer>{{Back}}"
+    fields = {"Back": "Halo"}
+
+    assert render_template(template, fields, front_side="<b>你好</b>") == "<b>你好</b><hr id=answer>Halo"
+    assert render_template(template, fields) == "<hr id=answer>Halo"
+
+
+def test_render_sound_refs():
+    media = {"clip.mp3": b"ID3"}
+
+    rendered = render_template("{{Audio}} [sound:gone.mp3]", {"Audio": "[sound:clip.mp3]"}, media_map=media)
+
+    assert "<audio controls" in rendered
+    assert "data:audio/mpeg;base64,SUQz" in rendered
+    assert '<span class="missing-media">[sound:gone.mp3]</span>' in rendered
+
+
+def test_sound_refs_are_encoded_once_per_shared_dict(monkeypatch):
+    calls = []
+    audio_tag = anki_preview._audio_tag
+    monkeypatch.setattr(
+        anki_preview, "_audio_tag", lambda name, data: calls.append(name) or audio_tag(name, data)
+    )
+    media = {"clip.mp3": b"ID3"}
+    encoded = {}
+
+    for _ in range(3):
+        render_template("[sound:clip.mp3]", {}, media_map=media, encoded=encoded)
+
+    assert calls == ["clip.mp3"]
+    assert set(encoded) == {"clip.mp3"}
+    # Without a shared dict nothing outlives the call.
+    render_template("[sound:clip.mp3]", {}, media_map=media)
+    assert calls == ["clip.mp3", "clip.mp3"]
+
+
+@pytest.mark.parametrize(
+    "template, expected",
+    [
+        # Unclosed section: the opening tag renders as an unknown field.
+        ("{{#A}}shown", "shown"),
+        # Stray and mismatched closers.
+        ("x{{/A}}y", "xy"),
+        ("{{#A}}a{{/B}}", "a"),
+        # Spaced section names are matched after stripping.
+        ("{{# A }}a{{/A}}{{^ A }}no-a{{/A}}", "a"),
+    ],
+)
+def test_malformed_templates_fall_back_to_rescanning(template, expected):
+    compiled = compile_template(template)
+
+    assert compiled.nodes is None
+    assert compiled.render({"A": "x"}) == expected
@@ -1,103 +1,13 @@
 from __future__ import annotations
 
+from dataclasses import replace
+import io
 import wave
 from pathlib import Path
-import sys
 import types
-import zipfile
+from typing import Optional
 
-ROOT = Path(__file__).resolve().parent.parent
-if str(ROOT) not in sys.path:
-    sys.path.insert(0, str(ROOT))
-
-
-def _ensure_stubs() -> None:
-    if "pydub" not in sys.modules:
-        pydub_module = types.ModuleType("pydub")
-
-        class _AudioSegment:
-            converter = None
-
-            def __init__(self, frames: int = 0) -> None:
-                self._frames = frames
-
-            @classmethod
-            def from_wav(cls, path: Path) -> "_AudioSegment":
-                with wave.open(str(path), "rb") as wav:
-                    frames = wav.getnframes()
-                return cls(frames)
-
-            def __len__(self) -> int:
-                return self._frames
-
-            def __add__(self, other: float) -> "_AudioSegment":  # volume adjustments ignored in stub
-                return self
-
-            def __mul__(self, repeat: int) -> "_AudioSegment":
-                return _AudioSegment(self._frames * repeat)
-
-            def __getitem__(self, item) -> "_AudioSegment":
-                if isinstance(item, slice):
-                    stop = item.stop or self._frames
-                    return _AudioSegment(min(self._frames, stop))
-                raise TypeError("AudioSegment slicing only supports slices in tests")
-
-            def overlay(self, other: "_AudioSegment") -> "_AudioSegment":
-                return _AudioSegment(max(self._frames, other._frames))
-
-            def export(self, path: Path, format: str, bitrate: str) -> None:
-                _write_silence(Path(path))
-
-        pydub_module.AudioSegment = _AudioSegment
-        sys.modules["pydub"] = pydub_module
-
-    if "genanki" not in sys.modules:
-        genanki_module = types.ModuleType("genanki")
-
-        class _Note:
-            def __init__(self, *, model, fields, tags):
-                self.model = model
-                self.fields = fields
-                self.tags = tags
-
-        class _Deck:
-            def __init__(self, deck_id: int, title: str):
-                self.deck_id = deck_id
-                self.title = title
-                self.notes = []
-
-            def add_note(self, note: _Note) -> None:
-                self.notes.append(note)
-
-        class _Model:
-            def __init__(self, model_id: int, name: str, fields, templates, css):
-                self.model_id = model_id
-                self.name = name
-                self.fields = fields
-                self.templates = templates
-                self.css = css
-
-        class _Package:
-            def __init__(self, deck: _Deck, media_files):
-                self.deck = deck
-                self.media_files = media_files
-
-            def write_to_file(self, path: Path) -> None:
-                with zipfile.ZipFile(path, "w") as archive:
-                    archive.writestr("collection.anki2", b"stub")
-                    for media in self.media_files:
-                        archive.write(media, arcname=Path(media).name)
-
-        genanki_module.Note = _Note
-        genanki_module.Deck = _Deck
-        genanki_module.Model = _Model
-        genanki_module.Package = _Package
-        sys.modules["genanki"] = genanki_module
-
-
-_ensure_stubs()
-
-from mandarin_anki import DeckBuildConfig, build_anki_deck
+from mandarin_anki import AudioGenerationConfig, DeckBuildConfig, build_anki_deck, generate_audio_from_text
 
 
 class _StubTTS:
@@ -116,45 +26,85 @@ class _StubFactory:
         return _StubTTS()
 
 
-def _write_silence(path: Path, duration_seconds: int = 1) -> None:
-    with wave.open(str(path), "w") as wav:
+def _silence_wav_bytes(duration_seconds: int = 1) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
         wav.setnchannels(1)
         wav.setsampwidth(2)
         wav.setframerate(22050)
-        num_frames = 22050 * duration_seconds
-        wav.writeframes(b"\x00\x00" * num_frames)
+        wav.writeframes(b"\x00\x00" * (22050 * duration_seconds))
+    return buffer.getvalue()
 
 
-def _build_wav(path: Path) -> None:
-    _write_silence(path)
+# One second of mono 22.05 kHz silence, built once for every stub WAV write.
+_SILENCE_WAV = _silence_wav_bytes()
 
 
-def test_build_anki_deck_creates_package(tmp_path):
-    csv_path = tmp_path / "deck.csv"
-    csv_path.write_text(
-        """Hanzi,Pinyin,Indo
-你好,nǐ hǎo,Halo
-谢谢,xièxie,Terima kasih
-""",
-        encoding="utf-8",
-    )
+def _write_silence(path: Path) -> None:
+    Path(path).write_bytes(_SILENCE_WAV)
+
+
+class _FixedFactory:
+    """Hand out one prebuilt TTS so the test can inspect it afterwards."""
+
+    def __init__(self, tts) -> None:
+        self.tts = tts
+
+    def create(self, model_name: str):
+        return self.tts
+
+
+def _speaker_wav(tmp_path: Path) -> Path:
+    path = tmp_path / "speaker.wav"
+    if not path.exists():
+        _write_silence(path)
+    return path
 
-    speaker_wav = tmp_path / "speaker.wav"
-    ambient_wav = tmp_path / "ambient.wav"
-    _build_wav(speaker_wav)
-    _build_wav(ambient_wav)
 
-    config = DeckBuildConfig(
+def _deck_config(
+    tmp_path: Path, csv_text: Optional[str] = None, *, name: str = "deck.csv", **overrides
+) -> DeckBuildConfig:
+    """Write ``csv_text`` (comma-delimited) and wrap it in a stub-model config."""
+
+    csv_path = tmp_path / name
+    if csv_text is not None:
+        csv_path.write_text(csv_text, encoding="utf-8")
+    fields = dict(
         csv_path=csv_path,
         output_dir=tmp_path / "output",
-        speaker_wav=speaker_wav,
+        speaker_wav=_speaker_wav(tmp_path),
         tts_model_name="stub",
-        tts_lang="zh",
-        ambient_wav=ambient_wav,
-        regenerate_audio_if_exists=True,
+        tts_lang="zh-cn",
         delimiter=",",
         audio_format="wav",
     )
+    fields.update(overrides)
+    return DeckBuildConfig(**fields)
+
+
+def _audio_config(tmp_path: Path, **overrides) -> AudioGenerationConfig:
+    fields = dict(
+        text="你好",
+        output_path=None,
+        speaker_wav=_speaker_wav(tmp_path),
+        tts_model_name="stub",
+        tts_lang="zh-cn",
+        audio_format="wav",
+        cache_dir=tmp_path / "cache",
+    )
+    fields.update(overrides)
+    return AudioGenerationConfig(**fields)
+
+
+def test_build_anki_deck_creates_package(tmp_path):
+    ambient_wav = tmp_path / "ambient.wav"
+    _write_silence(ambient_wav)
+    config = _deck_config(
+        tmp_path,
+        "Hanzi,Pinyin,Indo\n你好,nǐ hǎo,Halo\n谢谢,xièxie,Terima kasih\n",
+        ambient_wav=ambient_wav,
+        regenerate_audio_if_exists=True,
+    )
 
     stages = []
 
@@ -168,3 +118,287 @@ def test_build_anki_deck_creates_package(tmp_path):
     assert result.row_errors == []
     assert {"init", "rows", "row", "complete"}.issubset(stages)
     assert all(media.suffix == ".wav" and media.exists() for media in result.media_files)
+
+
+class _StubXtts:
+    def __init__(self) -> None:
+        self.latent_calls = 0
+        self.latent_kwargs = {}
+        self.texts = []
+        self.inference_kwargs = {}
+
+    def get_conditioning_latents(self, *, audio_path: str, **kwargs):
+        self.latent_calls += 1
+        self.latent_kwargs = kwargs
+        return "gpt-latent", "speaker-embedding"
+
+    def inference(self, text, language, gpt_cond_latent, speaker_embedding, **kwargs):
+        self.texts.append(text)
+        self.inference_kwargs = kwargs
+        return {"wav": [0.0] * 2400}
+
+
+class _StubXttsTTS(_StubTTS):
+    def __init__(self) -> None:
+        super().__init__()
+        self.synthesizer = types.SimpleNamespace(tts_model=_StubXtts())
+
+    def tts_to_file(self, **kwargs) -> None:  # pragma: no cover - must not be used
+        raise AssertionError("XTTS models should use the low-level inference API")
+
+
+def test_build_anki_deck_reuses_speaker_latents(tmp_path):
+    tts = _StubXttsTTS()
+    tts.synthesizer.tts_model.config = types.SimpleNamespace(
+        temperature=0.7,
+        length_penalty=1.0,
+        repetition_penalty=5.0,
+        top_k=40,
+        top_p=0.8,
+        gpt_cond_len=12,
+        gpt_cond_chunk_len=4,
+        max_ref_len=10,
+        sound_norm_refs=False,
+    )
+    config = _deck_config(tmp_path, "Hanzi,Pinyin,Indo\n你好,nǐ hǎo,Halo\n谢谢,xièxie,Terima kasih\n")
+
+    result = build_anki_deck(config, tts_factory=_FixedFactory(tts))
+
+    model = tts.synthesizer.tts_model
+    assert result.rows_processed == 2
+    assert model.latent_calls == 1
+    assert model.texts == ["你好", "谢谢"]
+    # The model config's settings reach the low-level calls, as with tts_to_file.
+    assert model.latent_kwargs == {
+        "gpt_cond_len": 12,
+        "gpt_cond_chunk_len": 4,
+        "max_ref_length": 10,
+        "sound_norm_refs": False,
+    }
+    assert model.inference_kwargs == {
+        "enable_text_splitting": True,
+        "temperature": 0.7,
+        "length_penalty": 1.0,
+        "repetition_penalty": 5.0,
+        "top_k": 40,
+        "top_p": 0.8,
+    }
+
+
+class _StubInMemoryTTS(_StubTTS):
+    def __init__(self) -> None:
+        super().__init__()
+        self.synthesizer = types.SimpleNamespace(output_sample_rate=22050)
+
+    def tts(self, *, text: str, speaker_wav: str, language: str, split_sentences: bool):
+        return [0.0] * 2205
+
+    def tts_to_file(self, **kwargs) -> None:  # pragma: no cover - must not be used
+        raise AssertionError("models with an in-memory API should not write scratch WAVs")
+
+
+def test_build_anki_deck_synthesises_in_memory(tmp_path):
+    config = _deck_config(tmp_path, "Hanzi,Pinyin,Indo\n你好,nǐ hǎo,Halo\n")
+
+    result = build_anki_deck(config, tts_factory=_FixedFactory(_StubInMemoryTTS()))
+
+    assert result.rows_processed == 1
+    assert not list(config.output_dir.glob("tts_*.wav"))
+
+
+def test_build_anki_deck_synthesises_repeated_text_once(tmp_path):
+    tts = _StubXttsTTS()
+    config = _deck_config(
+        tmp_path,
+        "Hanzi,Pinyin,Indo\n你好,nǐ hǎo,Halo\n谢谢,xièxie,Terima kasih\n你好,nǐ hǎo,Halo\n",
+        name="drill.csv",
+    )
+
+    result = build_anki_deck(config, tts_factory=_FixedFactory(tts))
+
+    assert result.rows_processed == 3
+    assert tts.synthesizer.tts_model.texts == ["你好", "谢谢"]
+    assert all(media.exists() for media in result.media_files)
+
+    renamed = tmp_path / "drill_copy.csv"
+    renamed.write_bytes(config.csv_path.read_bytes())
+    build_anki_deck(replace(config, csv_path=renamed), tts_factory=_FixedFactory(tts))
+
+    assert tts.synthesizer.tts_model.texts == ["你好", "谢谢"]
+
+
+def test_generate_audio_from_text_reuses_cached_clip(tmp_path):
+    tts = _StubXttsTTS()
+
+    def _generate(name: str):
+        config = _audio_config(tmp_path, output_path=tmp_path / name)
+        return generate_audio_from_text(config, tts_factory=_FixedFactory(tts))
+
+    first = _generate("first.wav")
+    second = _generate("second.wav")
+
+    assert tts.synthesizer.tts_model.texts == ["你好"]
+    assert second.read_bytes() == first.read_bytes()
+    # Hits are copies: editing one exported clip must not reach the cache.
+    assert second.stat().st_ino != first.stat().st_ino
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+
+
+def test_build_anki_deck_reads_csv_stream(tmp_path):
+    stream = io.BytesIO("Hanzi,Pinyin,Indo\n你好,nǐ hǎo,Halo\n".encode("utf-8"))
+    config = _deck_config(tmp_path, csv_path=Path("upload.csv"), csv_stream=stream)
+
+    result = build_anki_deck(config, tts_factory=_StubFactory())
+
+    assert result.rows_processed == 1
+    assert [media.name for media in result.media_files] == ["upload_001.wav"]
+    assert not stream.closed
+
+
+def test_build_anki_deck_ids_are_stable_across_builds(tmp_path, monkeypatch):
+    from mandarin_anki import builder
+
+    packages = []
+    monkeypatch.setattr(builder, "_write_apkg", lambda package, path: packages.append(package))
+    config = _deck_config(tmp_path, "Hanzi,Pinyin,Indo\n你好,nǐ hǎo,Halo\n")
+
+    build_anki_deck(config, tts_factory=_StubFactory())
+    build_anki_deck(config, tts_factory=_StubFactory())
+
+    first, second = packages
+    assert first.deck.deck_id == second.deck.deck_id
+    assert first.deck.title == second.deck.title
+    assert [note.guid for note in first.deck.notes] == [note.guid for note in second.deck.notes]
+    # The timestamp tag differs per build but must not reach the GUID.
+    assert first.deck.notes[0].guid == "deck-0001"
+    assert first.deck.notes[0].model.model_id == second.deck.notes[0].model.model_id
+    assert 1 << 30 <= first.deck.deck_id < 1 << 31
+
+
+def test_build_anki_deck_encodes_in_workers_from_file_stream(tmp_path):
+    config = _deck_config(
+        tmp_path, "Hanzi,Pinyin,Indo\n你好,nǐ hǎo,Halo\n谢谢,xièxie,Terima kasih\n", encode_workers=2
+    )
+
+    with open(config.csv_path, "rb") as stream:
+        result = build_anki_deck(
+            replace(config, csv_stream=stream), tts_factory=_FixedFactory(_StubXttsTTS())
+        )
+
+    assert result.row_errors == []
+    assert all(media.exists() for media in result.media_files)
+
+
+def test_build_anki_deck_last_row_owns_a_shared_audio_file(tmp_path):
+    tts = _StubXttsTTS()
+    config = _deck_config(
+        tmp_path,
+        "Hanzi,Pinyin,Indo,Audio\n你好,nǐ hǎo,Halo,x.wav\n谢谢,xièxie,Terima kasih,x.wav\n你好,nǐ hǎo,Halo,y.wav\n",
+        encode_workers=2,
+    )
+
+    result = build_anki_deck(config, tts_factory=_FixedFactory(tts))
+
+    assert result.row_errors == []
+    assert result.rows_processed == 3
+    # x.wav is written once, by the 谢谢 row; the second 你好 row is synthesised
+    # itself because the clip it would have copied from was overwritten.
+    assert tts.synthesizer.tts_model.texts == ["谢谢", "你好"]
+    assert sorted(media.name for media in result.media_files) == ["x.wav", "y.wav"]
+
+
+def test_build_anki_deck_caches_only_the_clip_left_on_disk(tmp_path):
+    tts = _StubXttsTTS()
+
+    def _build(name: str, body: str, **overrides):
+        config = _deck_config(tmp_path, "Hanzi,Pinyin,Indo,Audio\n" + body, name=name, **overrides)
+        return build_anki_deck(config, tts_factory=_FixedFactory(tts))
+
+    _build("shared.csv", "你好,nǐ hǎo,Halo,x.wav\n谢谢,xièxie,Terima kasih,x.wav\n")
+    _build("split.csv", "你好,nǐ hǎo,Halo,a.wav\n谢谢,xièxie,Terima kasih,b.wav\n")
+
+    # x.wav holds 谢谢, so only that clip may be reused for the second deck.
+    assert tts.synthesizer.tts_model.texts == ["谢谢", "你好"]
+
+    _build("fp32.csv", "谢谢,xièxie,Terima kasih,c.wav\n", tts_fp16=False)
+
+    assert tts.synthesizer.tts_model.texts == ["谢谢", "你好", "谢谢"]
+
+
+def test_synthesis_on_a_shared_model_runs_one_call_at_a_time(tmp_path):
+    import threading
+    import time
+
+    from mandarin_anki import builder
+
+    speaker_wav = _speaker_wav(tmp_path)
+    tts = _StubXttsTTS()
+    model = tts.synthesizer.tts_model
+    active = []
+    overlaps = []
+
+    def _inference(text, language, gpt_cond_latent, speaker_embedding, **kwargs):
+        active.append(text)
+        overlaps.append(len(active))
+        time.sleep(0.01)
+        active.remove(text)
+        return {"wav": [0.0] * 2400}
+
+    model.inference = _inference
+
+    def _run(text: str) -> None:
+        synthesizer = builder._SpeakerSynthesizer(tts, speaker_wav=speaker_wav, language="zh-cn")
+        for _ in range(3):
+            synthesizer.synthesize(text, tmp_wav=tmp_path / f"{text}.wav")
+
+    threads = [threading.Thread(target=_run, args=(text,)) for text in ("你好", "谢谢")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert overlaps and max(overlaps) == 1
+
+
+def test_write_apkg_stores_compressed_media_and_deflates_the_collection(tmp_path):
+    import json
+    import zipfile
+
+    from mandarin_anki import builder
+
+    clip = tmp_path / "clip.mp3"
+    clip.write_bytes(b"ID3" + bytes(256))
+    wav = tmp_path / "clip.wav"
+    _write_silence(wav)
+
+    class _Package:
+        media_files = [str(clip), str(wav)]
+
+        def write_to_db(self, cursor, timestamp, id_gen):
+            cursor.execute("CREATE TABLE notes (id INTEGER PRIMARY KEY)")
+            cursor.execute("INSERT INTO notes VALUES (?)", (next(id_gen),))
+
+    apkg_path = tmp_path / "deck.apkg"
+    builder._write_apkg(_Package(), apkg_path)
+
+    with zipfile.ZipFile(apkg_path) as archive:
+        infos = {info.filename: info for info in archive.infolist()}
+        assert infos["collection.anki2"].compress_type == zipfile.ZIP_DEFLATED
+        assert infos["media"].compress_type == zipfile.ZIP_DEFLATED
+        assert infos["0"].compress_type == zipfile.ZIP_STORED
+        assert infos["1"].compress_type == zipfile.ZIP_DEFLATED
+        assert json.loads(archive.read("media")) == {"0": "clip.mp3", "1": "clip.wav"}
+        assert archive.read("0") == clip.read_bytes()
+        assert archive.read("collection.anki2").startswith(b"SQLite format 3")
+
+
+def test_generate_audio_from_text_can_keep_the_clip_in_the_cache(tmp_path):
+    tts = _StubXttsTTS()
+
+    first = generate_audio_from_text(_audio_config(tmp_path), tts_factory=_FixedFactory(tts))
+    second = generate_audio_from_text(_audio_config(tmp_path), tts_factory=_FixedFactory(tts))
+
+    assert first == second
+    assert first.parent == tmp_path / "cache"
+    assert tts.synthesizer.tts_model.texts == ["你好"]
+    assert [path.name for path in (tmp_path / "cache").iterdir()] == [first.name]